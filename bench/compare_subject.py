@@ -0,0 +1,99 @@
+"""Compares the local keyphrase subject extractor with the Mistral subject call.
+
+For every question it measures subject latency in both modes and the overlap of
+the chunks retrieved with each subject.
+
+Usage: python bench/compare_subject.py [--queries bench/queries.txt] [--json out.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(current_dir), "src", "server"))
+
+from reponse import Generation
+
+MODES = ["local", "llm"]
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def load_queries(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def run(generation, queries):
+    rows = []
+    for query in queries:
+        row = {"query": query}
+        for mode in MODES:
+            start = time.perf_counter()
+            if mode == "local":
+                subject = generation.local_subject(query) or ""
+            else:
+                subject = generation.question_subject(query)
+            row[f"{mode}_ms"] = (time.perf_counter() - start) * 1000
+            row[f"{mode}_subject"] = subject
+            _, results = generation.pipeline.query_search_db(subject or query, lexical_query=query)
+            row[f"{mode}_ids"] = results["ids"][0]
+
+        local_ids, llm_ids = set(row["local_ids"]), set(row["llm_ids"])
+        union = local_ids | llm_ids
+        row["overlap"] = len(local_ids & llm_ids) / len(union) if union else 1.0
+        row["top1_match"] = bool(row["local_ids"]) and row["local_ids"][:1] == row["llm_ids"][:1]
+        rows.append(row)
+    return rows
+
+def summarize(rows):
+    summary = {}
+    for mode in MODES:
+        latencies = [r[f"{mode}_ms"] for r in rows]
+        summary[mode] = {
+            "mean_ms": round(statistics.mean(latencies), 1),
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+        }
+    summary["mean_overlap"] = round(statistics.mean(r["overlap"] for r in rows), 3)
+    summary["top1_agreement"] = round(sum(r["top1_match"] for r in rows) / len(rows), 3)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", default=os.path.join(current_dir, "queries.txt"))
+    parser.add_argument("--json", help="ecrit le detail par question dans ce fichier")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    generation = Generation()
+    rows = run(generation, queries)
+    summary = summarize(rows)
+
+    print("=" * 80)
+    print("   SUJET LOCAL vs SUJET LLM ".center(80))
+    print("=" * 80)
+    for r in rows:
+        print(f"\n{r['query']}")
+        print(f"  local ({r['local_ms']:7.1f} ms): {r['local_subject']}")
+        print(f"  llm   ({r['llm_ms']:7.1f} ms): {r['llm_subject']}")
+        print(f"  recouvrement des chunks: {r['overlap']:.2f}")
+    print("\n" + "=" * 80)
+    for mode in MODES:
+        m = summary[mode]
+        print(f"{mode:>5}: moyenne {m['mean_ms']} ms | p50 {m['p50_ms']} ms | p95 {m['p95_ms']} ms")
+    print(f"Recouvrement moyen (Jaccard): {summary['mean_overlap']}")
+    print(f"Meme meilleur chunk: {summary['top1_agreement'] * 100:.0f}%")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "rows": rows}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
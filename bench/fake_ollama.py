@@ -0,0 +1,84 @@
+"""Fake Ollama server for benchmarks: /api/generate with configurable latency and throughput.
+
+Usage: python bench/fake_ollama.py [--port 11435] [--prefill-ms 200] [--token-ms 20]
+                                   [--tokens 120] [--slots 2]
+"""
+import os
+import json
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# Temps de traitement du prompt, temps par token genere, longueur de reponse,
+# et nombre de generations simultanees (comme OLLAMA_NUM_PARALLEL)
+PREFILL_MS = float(os.getenv("FAKE_OLLAMA_PREFILL_MS", "200"))
+TOKEN_MS = float(os.getenv("FAKE_OLLAMA_TOKEN_MS", "20"))
+ANSWER_TOKENS = int(os.getenv("FAKE_OLLAMA_TOKENS", "120"))
+SUBJECT_TOKENS = int(os.getenv("FAKE_OLLAMA_SUBJECT_TOKENS", "6"))
+SLOTS = int(os.getenv("FAKE_OLLAMA_SLOTS", "2"))
+
+WORDS = ("le producteur de déchets doit confier ses déchets à un collecteur agréé "
+         "et conserver les preuves de collecte conformément à l'arrêté ").split()
+
+app = FastAPI()
+slots = None
+
+def get_slots():
+    global slots
+    if slots is None:
+        slots = asyncio.Semaphore(max(1, SLOTS))
+    return slots
+
+def token_count(prompt):
+    # Le prompt de sujet demande "UN SEUL sujet": reponse courte
+    return SUBJECT_TOKENS if "UN SEUL sujet" in prompt else ANSWER_TOKENS
+
+async def tokens(n):
+    for i in range(n):
+        await asyncio.sleep(TOKEN_MS / 1000)
+        yield ("" if i == 0 else " ") + WORDS[i % len(WORDS)]
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": "mistral:latest"}]}
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    prompt = body.get("prompt", "")
+    n = token_count(prompt)
+    usage = {"prompt_eval_count": max(1, len(prompt) // 4), "eval_count": n}
+
+    if not body.get("stream", True):
+        async with get_slots():
+            await asyncio.sleep(PREFILL_MS / 1000)
+            text = "".join([t async for t in tokens(n)])
+        return {"model": body.get("model"), "response": text, "done": True, **usage}
+
+    async def stream():
+        async with get_slots():
+            await asyncio.sleep(PREFILL_MS / 1000)
+            async for t in tokens(n):
+                yield json.dumps({"response": t, "done": False}) + "\n"
+        yield json.dumps({"response": "", "done": True, **usage}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def main():
+    global PREFILL_MS, TOKEN_MS, ANSWER_TOKENS, SLOTS
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--prefill-ms", type=float, default=PREFILL_MS)
+    parser.add_argument("--token-ms", type=float, default=TOKEN_MS)
+    parser.add_argument("--tokens", type=int, default=ANSWER_TOKENS)
+    parser.add_argument("--slots", type=int, default=SLOTS)
+    args = parser.parse_args()
+    PREFILL_MS, TOKEN_MS, ANSWER_TOKENS, SLOTS = args.prefill_ms, args.token_ms, args.tokens, args.slots
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
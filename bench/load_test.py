@@ -0,0 +1,204 @@
+"""End-to-end load test of the API against the local ADLS stand-in and the fake Ollama.
+
+Starts bench/fake_ollama.py and the FastAPI app (uvicorn) as subprocesses, replays
+a query corpus at fixed concurrency levels and reports p50/p95/p99 latency,
+throughput and server memory.
+
+Usage:
+    python bench/seed_index.py --root /tmp/adls
+    python bench/load_test.py --root /tmp/adls [--concurrency 1,8,32,128] [--requests 200]
+                              [--endpoint /search|/search/stream] [--cache] [--json out.json]
+
+The semantic answer cache is disabled by default: the corpus is replayed many times per
+level, so with the cache on almost every request is a cache hit (pass --cache to measure that).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import httpx
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+server_dir = os.path.join(project_root, "src", "server")
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def rss_mb(pid):
+    """Resident memory of a process and its children, from /proc (Linux)"""
+    total = 0
+    pids = [pid]
+    try:
+        children = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True).stdout.split()
+        pids += [int(c) for c in children]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+def wait_ready(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(1)
+    return False
+
+def start_processes(args):
+    env = dict(os.environ)
+    env.update({
+        "FAKE_OLLAMA_PREFILL_MS": str(args.prefill_ms),
+        "FAKE_OLLAMA_TOKEN_MS": str(args.token_ms),
+        "FAKE_OLLAMA_TOKENS": str(args.tokens),
+        "FAKE_OLLAMA_SLOTS": str(args.slots),
+    })
+    # Une instance par port consecutif, reparties par le pool du serveur
+    ports = [args.ollama_port + i for i in range(args.ollama_instances)]
+    ollamas = [
+        subprocess.Popen(
+            [sys.executable, os.path.join(current_dir, "fake_ollama.py"), "--port", str(port),
+             "--prefill-ms", str(args.prefill_ms), "--token-ms", str(args.token_ms),
+             "--tokens", str(args.tokens), "--slots", str(args.slots)],
+            env=env,
+        )
+        for port in ports
+    ]
+
+    env.update({
+        "ADLS_LOCAL_ROOT": args.root,
+        "OLLAMA_HOSTS": ",".join(f"http://127.0.0.1:{port}" for port in ports),
+        "CHROMA_CACHE_DIR": tempfile.mkdtemp(prefix="bench_chroma_cache_"),
+        "LOG_SAMPLE_RATE": "0",
+        "CACHE_ENABLED": "1" if args.cache else "0",
+        "PYTHONPATH": server_dir,
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bridge:app", "--host", "127.0.0.1",
+         "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=server_dir,
+        env=env,
+    )
+    return ollamas, server
+
+async def one_request(client, endpoint, query):
+    start = time.perf_counter()
+    first_byte = None
+    if endpoint.endswith("/stream"):
+        async with client.stream("POST", endpoint, json={"query": query}) as r:
+            r.raise_for_status()
+            async for _ in r.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+    else:
+        r = await client.post(endpoint, json={"query": query})
+        r.raise_for_status()
+        first_byte = time.perf_counter() - start
+    return time.perf_counter() - start, first_byte
+
+async def run_level(base_url, endpoint, queries, concurrency, total):
+    latencies, ttfb, errors = [], [], 0
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                try:
+                    latency, first = await one_request(client, endpoint, queries[i % len(queries)])
+                    latencies.append(latency)
+                    ttfb.append(first)
+                except Exception:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "ttfb_p50_ms": round(percentile(ttfb, 50) * 1000, 1),
+        "ttfb_p95_ms": round(percentile(ttfb, 95) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", required=True, help="faux ADLS cree par seed_index.py")
+    parser.add_argument("--queries", default=os.path.join(current_dir, "queries.txt"))
+    parser.add_argument("--endpoint", default="/search")
+    parser.add_argument("--concurrency", default="1,8,32,128")
+    parser.add_argument("--requests", type=int, default=200, help="requetes par niveau de concurrence")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--ollama-instances", type=int, default=1, help="faux Ollama sur des ports consecutifs")
+    parser.add_argument("--prefill-ms", type=float, default=200)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--cache", action="store_true", help="active le cache semantique des reponses (desactive par defaut)")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--json", help="ecrit les resultats dans ce fichier")
+    args = parser.parse_args()
+
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    ollamas, server = start_processes(args)
+    try:
+        if not wait_ready(f"{base_url}/admin/index", args.startup_timeout):
+            raise SystemExit("Le serveur n'a pas demarre a temps.")
+        idle_rss = rss_mb(server.pid)
+
+        results = []
+        for level in levels:
+            report = asyncio.run(run_level(base_url, args.endpoint, queries, level, args.requests))
+            report["rss_mb"] = round(rss_mb(server.pid), 1)
+            results.append(report)
+            print(
+                f"c={report['concurrency']:>4} | {report['throughput_rps']:>7} req/s | "
+                f"p50 {report['p50_ms']:>8} ms | p95 {report['p95_ms']:>8} ms | p99 {report['p99_ms']:>8} ms | "
+                f"ttfb p50 {report['ttfb_p50_ms']:>8} ms | erreurs {report['errors']} | RSS {report['rss_mb']} Mo"
+            )
+        print(f"RSS au repos: {idle_rss:.1f} Mo")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"endpoint": args.endpoint, "cache": args.cache, "idle_rss_mb": idle_rss, "levels": results}, f, indent=2)
+    finally:
+        for process in [server] + ollamas:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+if __name__ == "__main__":
+    main()
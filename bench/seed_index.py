@@ -0,0 +1,107 @@
+"""Builds a local stand-in of the ADLS 'data' file system for benchmarks.
+
+Creates <root>/data/chromadb (collection "law_text", same id and metadata layout
+as the batch indexer) and <root>/data/base_dechets.json, from a folder of .txt
+files or from a synthetic regulation corpus.
+
+Usage: python bench/seed_index.py --root /tmp/adls [--source DIR] [--documents 200]
+"""
+import os
+import sys
+import random
+import shutil
+import argparse
+from datetime import datetime, timezone
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(current_dir), "src", "server"))
+# Classifieur du batch, pour etiqueter les chunks comme l'indexeur (apres src/server: embeddings du serveur)
+sys.path.append(os.path.join(os.path.dirname(current_dir), "src", "batch"))
+
+import chromadb
+from embeddings import load_embedding_model
+from classifier import CategoryClassifier
+
+SUBJECTS = [
+    "déchets dangereux", "huiles usagées", "emballages PMC", "papier et carton", "verre",
+    "déchets de construction", "gravats de chantier", "déchets organiques", "piles et batteries",
+    "déchets électroniques", "amiante", "solvants", "déchets alimentaires",
+]
+SENTENCES = [
+    "Le producteur de {s} est tenu de les confier à un collecteur enregistré en Région de Bruxelles-Capitale.",
+    "Article {n}. Les {s} sont triés à la source et stockés séparément des autres déchets.",
+    "Le collecteur remet une attestation de collecte des {s} qui est conservée pendant cinq ans.",
+    "En cas d'infraction aux dispositions relatives aux {s}, une amende administrative peut être infligée.",
+    "Article {n}, paragraphe {p}. Bruxelles Environnement contrôle le respect des obligations de tri des {s}.",
+    "Les entreprises qui produisent des {s} tiennent un registre des quantités produites et collectées.",
+]
+
+def chunking(text, chunk_size=450, overlap=50):
+    # Meme decoupage que RetrievalPipeline.chunking cote batch
+    chunks = []
+    start = 0
+    while start < len(text):
+        chunk = text[start:start + chunk_size]
+        if len(chunk) >= 250:
+            chunks.append(chunk)
+        start += chunk_size - overlap
+    return chunks
+
+def synthetic_documents(count, seed=42):
+    rng = random.Random(seed)
+    for d in range(count):
+        sentences = [
+            rng.choice(SENTENCES).format(s=rng.choice(SUBJECTS), n=rng.randint(1, 120), p=rng.randint(1, 6))
+            for _ in range(rng.randint(20, 80))
+        ]
+        yield f"arrete_dechets_{d:04d}", " ".join(sentences).lower()
+
+def folder_documents(path):
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".txt"):
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                yield os.path.splitext(name)[0][:60], f.read()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", required=True, help="dossier racine du faux ADLS (ADLS_LOCAL_ROOT)")
+    parser.add_argument("--source", help="dossier de fichiers .txt a indexer au lieu du corpus synthetique")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=128)
+    args = parser.parse_args()
+
+    data_dir = os.path.join(args.root, "data")
+    db_dir = os.path.join(data_dir, "chromadb")
+    shutil.rmtree(db_dir, ignore_errors=True)
+    os.makedirs(db_dir)
+    vocabulary_path = os.path.join(data_dir, "base_dechets.json")
+    shutil.copy(os.path.join(current_dir, "base_dechets.json"), vocabulary_path)
+    with open(vocabulary_path, encoding="utf-8") as f:
+        classifier = CategoryClassifier.from_json(f.read())
+
+    documents = folder_documents(args.source) if args.source else synthetic_documents(args.documents)
+    ids, texts, metadatas = [], [], []
+    for file_id, text in documents:
+        chunks = chunking(text)
+        # Memes categories que l'indexeur: le routage par categorie se comporte comme en production
+        for i, (chunk, category) in enumerate(zip(chunks, classifier.classify_batch(chunks))):
+            ids.append(f"{file_id}_chunk_{i}")
+            texts.append(chunk)
+            metadatas.append({"source": file_id, "categorie": category, "date": "unknow", "chunk_id": len(ids)})
+
+    model = load_embedding_model()
+    client = chromadb.PersistentClient(path=db_dir)
+    collection = client.get_or_create_collection(
+        name="law_text",
+        metadata={"index_version": datetime.now(timezone.utc).isoformat()},
+    )
+    for start in range(0, len(ids), args.batch_size):
+        end = start + args.batch_size
+        embeddings = model.encode(texts[start:end], batch_size=args.batch_size, convert_to_numpy=True)
+        collection.add(ids=ids[start:end], documents=texts[start:end], embeddings=embeddings.tolist(), metadatas=metadatas[start:end])
+
+    print(f"{len(ids)} chunks indexés dans {db_dir}")
+    print(f"Lancez le serveur avec ADLS_LOCAL_ROOT={args.root}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import re
+import json
+import numpy as np
+
+# Separateur entre textes en mode lot: aucun mot-cle ne peut le traverser
+BATCH_SEPARATOR = "\n\x00\n"
+
+class CategoryClassifier:
+    """
+    Classe les segments selon le vocabulaire de base_dechets.json
+
+    Tous les mots-cles sont compiles en une seule expression reguliere: un segment est
+    parcouru une seule fois, quel que soit le nombre de categories et de mots-cles.
+    Le score d'une categorie reste (nombre d'occurrences de ses mots-cles) * poids.
+    """
+
+    def __init__(self, vocabulary):
+        self.categories = list(vocabulary)
+        self.keywords = []
+        self.index = {}
+        for data in vocabulary.values():
+            for word in data["keywords"]:
+                if word and word not in self.index:
+                    self.index[word] = len(self.keywords)
+                    self.keywords.append(word)
+
+        # Poids de chaque mot-cle pour chaque categorie (un mot-cle repete compte plusieurs fois)
+        self.weights = np.zeros((len(self.keywords), len(self.categories)), dtype=np.float64)
+        for c, data in enumerate(vocabulary.values()):
+            for word in data["keywords"]:
+                if word:
+                    self.weights[self.index[word], c] += data["weight"]
+
+        # Mots-cles qui commencent un mot-cle plus long ("dechets" dans "dechets dangereux"):
+        # une occurrence du plus long compte aussi pour eux, comme avec un findall par mot-cle
+        self.prefixes = [
+            [self.index[other] for other in self.keywords
+             if other != word and word.startswith(other) and re.fullmatch(re.escape(other) + r"\b.*", word, re.S)]
+            for word in self.keywords
+        ]
+
+        self.pattern = None
+        if self.keywords:
+            # Lookahead: les occurrences qui se chevauchent sont toutes trouvees
+            alternatives = "|".join(re.escape(k) for k in sorted(self.keywords, key=len, reverse=True))
+            self.pattern = re.compile(r"\b(?=(" + alternatives + r")\b)")
+
+    @classmethod
+    def from_json(cls, json_content):
+        return cls(json.loads(json_content))
+
+    def keyword_counts(self, text):
+        """Nombre d'occurrences de chaque mot-cle dans le texte, en un seul parcours"""
+        counts = np.zeros(len(self.keywords), dtype=np.float64)
+        if self.pattern is None:
+            return counts
+        for match in self.pattern.finditer(text):
+            k = self.index[match.group(1)]
+            counts[k] += 1
+            for prefix in self.prefixes[k]:
+                counts[prefix] += 1
+        return counts
+
+    def scores(self, text):
+        """Score de chaque categorie pour un segment"""
+        return dict(zip(self.categories, self.keyword_counts(text) @ self.weights))
+
+    def classify(self, text):
+        """Categorie dominante d'un segment (la premiere du fichier en cas d'egalite)"""
+        if not self.categories:
+            return None
+        return self.categories[int(np.argmax(self.keyword_counts(text) @ self.weights))]
+
+    def classify_batch(self, texts):
+        """
+        Categorie dominante de chaque segment
+
+        Les segments sont concatenes et parcourus en un seul passage de l'expression
+        reguliere; les occurrences sont ensuite ventilees par segment et les scores
+        calcules par un seul produit matriciel.
+        """
+        if not texts:
+            return []
+        if not self.categories:
+            return [None] * len(texts)
+
+        counts = np.zeros((len(texts), len(self.keywords)), dtype=np.float64)
+        if self.pattern is not None:
+            joined = BATCH_SEPARATOR.join(texts)
+            # Debut de chaque segment dans le texte concatene
+            starts = np.cumsum([0] + [len(t) + len(BATCH_SEPARATOR) for t in texts[:-1]])
+            offsets, keys = [], []
+            for match in self.pattern.finditer(joined):
+                k = self.index[match.group(1)]
+                for key in [k] + self.prefixes[k]:
+                    offsets.append(match.start())
+                    keys.append(key)
+            if offsets:
+                rows = np.searchsorted(starts, offsets, side="right") - 1
+                np.add.at(counts, (rows, keys), 1)
+
+        best = np.argmax(counts @ self.weights, axis=1)
+        return [self.categories[int(c)] for c in best]
@@ -0,0 +1,129 @@
+import os
+import json
+import zlib
+import hashlib
+import numpy as np
+
+# Index des empreintes des fichiers de clean_data, conserve dans ADLS entre deux executions
+DEDUP_INDEX_FILE = "dedup_index.json"
+# "exact" (meme contenu) ou "near" (quasi-doublons par MinHash/LSH, ex: meme texte avec un autre pied de page)
+DEDUP_MODE = os.getenv("DEDUP_MODE", "exact").strip().lower()
+# Similarite de Jaccard estimee a partir de laquelle deux textes sont des quasi-doublons
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.85"))
+
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16
+MINHASH_PRIME = 4294967311
+# Graine fixe: les signatures sont persistees et doivent rester comparables d'une execution a l'autre
+_rng = np.random.RandomState(20240611)
+MINHASH_A = _rng.randint(1, 2**32 - 1, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+MINHASH_B = _rng.randint(0, 2**32 - 1, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Ensemble des suites de size mots du texte"""
+    words = text.split()
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def minhash(text, block=8192):
+    """Signature MinHash du texte (une valeur minimale par permutation)"""
+    values = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+    signature = np.full(MINHASH_PERMUTATIONS, MINHASH_PRIME, dtype=np.uint64)
+    # Par blocs de shingles pour borner la memoire de la matrice (shingles x permutations)
+    for start in range(0, len(values), block):
+        hashed = (np.outer(values[start:start + block], MINHASH_A) + MINHASH_B) % MINHASH_PRIME
+        signature = np.minimum(signature, hashed.min(axis=0))
+    return signature
+
+class DedupIndex:
+    """
+    Empreintes des fichiers nettoyes: un nouveau fichier coute un hash et une recherche
+
+    files: {nom du fichier: {"sha256": ..., "minhash": [...] en mode "near"}}
+    """
+
+    def __init__(self, files=None, mode=DEDUP_MODE, threshold=NEAR_DUP_THRESHOLD):
+        self.mode = mode
+        self.threshold = threshold
+        self.rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        self.files = {}
+        self.by_hash = {}
+        self.buckets = {}
+        for name, entry in (files or {}).items():
+            self.add(name, entry)
+
+    @classmethod
+    def load(cls, file_system_client):
+        """Charge l'index depuis ADLS (vide s'il n'existe pas encore)"""
+        try:
+            file_client = file_system_client.get_file_client(DEDUP_INDEX_FILE)
+            if hasattr(file_client, "read_file"):
+                downloader = file_client.read_file()
+            else:
+                downloader = file_client.download_file()
+            return cls(json.loads(downloader.readall().decode("utf-8"))["files"])
+        except Exception:
+            return cls()
+
+    def to_json(self):
+        return json.dumps({"files": self.files}, ensure_ascii=False)
+
+    def bands(self, signature):
+        return [(b, tuple(int(v) for v in signature[b * self.rows:(b + 1) * self.rows])) for b in range(LSH_BANDS)]
+
+    def entry(self, text):
+        """Empreintes d'un texte pour le mode courant"""
+        entry = {"sha256": content_hash(text)}
+        if self.mode == "near":
+            entry["minhash"] = [int(v) for v in minhash(text)]
+        return entry
+
+    def complete(self, name):
+        """Vrai si le fichier est deja indexe avec les empreintes du mode courant"""
+        entry = self.files.get(name)
+        return entry is not None and (self.mode != "near" or "minhash" in entry)
+
+    def near_duplicate(self, name, signature):
+        # Candidats: au moins une bande identique; verification sur la signature complete
+        candidates = set()
+        for key in self.bands(signature):
+            candidates.update(self.buckets.get(key, ()))
+        candidates.discard(name)
+        best, best_score = None, 0.0
+        for other in candidates:
+            score = float(np.mean(np.asarray(self.files[other]["minhash"], dtype=np.uint64) == signature))
+            if score >= self.threshold and score > best_score:
+                best, best_score = other, score
+        return best
+
+    def find_duplicate(self, name, entry):
+        """Nom du fichier deja indexe dont ce contenu est un doublon, None sinon"""
+        original = self.by_hash.get(entry["sha256"])
+        if original is not None and original != name:
+            return original
+        if "minhash" in entry:
+            return self.near_duplicate(name, np.asarray(entry["minhash"], dtype=np.uint64))
+        return None
+
+    def add(self, name, entry):
+        self.remove(name)
+        self.files[name] = entry
+        self.by_hash.setdefault(entry["sha256"], name)
+        if "minhash" in entry:
+            for key in self.bands(entry["minhash"]):
+                self.buckets.setdefault(key, set()).add(name)
+
+    def remove(self, name):
+        entry = self.files.pop(name, None)
+        if entry is None:
+            return
+        if self.by_hash.get(entry["sha256"]) == name:
+            del self.by_hash[entry["sha256"]]
+        if "minhash" in entry:
+            for key in self.bands(entry["minhash"]):
+                self.buckets.get(key, set()).discard(name)
@@ -0,0 +1,227 @@
+import os
+import time
+import queue
+import itertools
+import collections
+import multiprocessing
+from io import BytesIO
+from pypdf import PdfReader
+from docx import Document
+
+# Processus d'extraction (pypdf est du Python pur: un processus par coeur)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+# Au-dela de ce nombre de pages, un PDF est extrait par plages de pages reparties sur les processus
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "50"))
+# Duree maximale (secondes) de l'extraction d'un fichier, toutes plages de pages comprises,
+# comptee a partir du moment ou un processus commence a le traiter
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "300"))
+
+def extract_pages(data, start, end):
+    """Texte des pages [start, end) d'un PDF"""
+    reader = PdfReader(BytesIO(data))
+    return "".join(reader.pages[i].extract_text() or "" for i in range(start, end))
+
+def extract_document(data, pages_per_task):
+    """
+    Premiere etape d'extraction d'un fichier (PDF, sinon DOCX)
+
+    Returns:
+        (nombre de pages ou de paragraphes, texte, pages restantes a extraire)
+        Pour un gros PDF seules les pages_per_task premieres pages sont extraites ici.
+    """
+    try:
+        reader = PdfReader(BytesIO(data))
+        count = len(reader.pages)
+        end = min(count, pages_per_task)
+        text = "".join(reader.pages[i].extract_text() or "" for i in range(end))
+        return count, text, (end, count)
+    except Exception:
+        pass
+    # Si ce n'est pas un PDF, essayer DOCX
+    try:
+        doc = Document(BytesIO(data))
+    except Exception as e:
+        raise ValueError(f"format non supporté ou fichier corrompu: {e}")
+    return len(doc.paragraphs), "".join(paragraph.text + "\n" for paragraph in doc.paragraphs), None
+
+def extract_worker(tasks, results):
+    """Boucle d'un processus d'extraction: une tache a la fois, recue sur sa propre file"""
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, function, args = task
+        try:
+            results.put(("done", task_id, function(*args)))
+        except Exception as e:
+            results.put(("error", task_id, str(e)))
+
+class ParallelExtractor:
+    """
+    Extrait le texte des PDF/DOCX sur des processus dedies
+
+    Au plus `workers` fichiers sont en cours a la fois (memoire bornee). Un gros PDF est
+    decoupe en plages de pages extraites en parallele puis reassemblees dans l'ordre.
+    Chaque processus a sa propre file et ne recoit une tache que lorsqu'il est libre: le
+    processus principal sait toujours quelle tache tourne ou. Un fichier dispose de `timeout`
+    secondes a partir de sa premiere tache demarree; au-dela il echoue, et seuls les processus
+    qui travaillent encore dessus sont arretes puis remplaces. Un processus mort fait echouer
+    le fichier de la tache qu'il avait recue.
+    """
+
+    def __init__(self, workers=EXTRACT_WORKERS, pages_per_task=EXTRACT_PAGES_PER_TASK, timeout=EXTRACT_TIMEOUT):
+        self.workers = max(1, workers)
+        self.pages_per_task = max(1, pages_per_task)
+        self.timeout = timeout
+        # pid -> {"process", "tasks", "task"}: task = id de la tache en cours, None si libre
+        self.processes = {}
+        self.ids = itertools.count()
+        # task_id -> (job, index, fonction, arguments), jusqu'a son resultat
+        self.running = {}
+        # Taches en attente d'un processus libre
+        self.queued = collections.deque()
+
+    def start(self):
+        # spawn: comme pour l'encodage, pas d'heritage par fork des threads du processus principal
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        for _ in range(self.workers):
+            self.spawn()
+
+    def spawn(self):
+        tasks = self.context.Queue()
+        process = self.context.Process(target=extract_worker, args=(tasks, self.results), daemon=True)
+        process.start()
+        self.processes[process.pid] = {"process": process, "tasks": tasks, "task": None}
+
+    def replace(self, pid):
+        """Arrete un processus bloque (ou deja mort) et en demarre un autre a sa place"""
+        worker = self.processes.pop(pid)
+        if worker["process"].is_alive():
+            worker["process"].terminate()
+        worker["process"].join()
+        worker["tasks"].close()
+        self.spawn()
+
+    def submit(self, job, index, function, args):
+        task_id = next(self.ids)
+        self.running[task_id] = (job, index, function, args)
+        job["pending"].add(task_id)
+        self.queued.append(task_id)
+
+    def dispatch(self):
+        """Donne les taches en attente aux processus libres"""
+        for worker in self.processes.values():
+            while worker["task"] is None and self.queued:
+                task_id = self.queued.popleft()
+                job, index, function, args = self.running[task_id]
+                if job["error"] is not None:
+                    # Fichier deja en echec: la tache n'est pas lancee
+                    del self.running[task_id]
+                    continue
+                if job["deadline"] is None:
+                    job["deadline"] = time.monotonic() + self.timeout
+                worker["task"] = task_id
+                worker["tasks"].put((task_id, function, args))
+
+    def fail(self, job, error):
+        if job["error"] is None:
+            job["error"] = error
+        # Les autres taches du fichier sont ignorees; celles deja lancees restent bornees par son delai
+        job["pending"].clear()
+
+    def handle(self, kind, task_id, value):
+        for worker in self.processes.values():
+            if worker["task"] == task_id:
+                worker["task"] = None
+        task = self.running.pop(task_id, None)
+        if task is None:
+            return
+        job, index = task[0], task[1]
+        if job["error"] is not None:
+            return
+        job["pending"].discard(task_id)
+        if kind == "error":
+            self.fail(job, value)
+        elif index == 0:
+            count, text, remaining = value
+            job["count"] = count
+            job["parts"][0] = text
+            if remaining is not None:
+                start, end = remaining
+                for i, s in enumerate(range(start, end, self.pages_per_task), 1):
+                    self.submit(job, i, extract_pages, (job["data"], s, min(s + self.pages_per_task, end)))
+        else:
+            job["parts"][index] = value
+
+    def check_running(self):
+        """Arrete les processus dont le fichier a depasse son delai et remplace ceux qui sont morts"""
+        now = time.monotonic()
+        for pid, worker in list(self.processes.items()):
+            task_id = worker["task"]
+            alive = worker["process"].is_alive()
+            if task_id is None:
+                if not alive:
+                    self.replace(pid)
+                continue
+            job = self.running[task_id][0]
+            timed_out = now > job["deadline"]
+            if alive and not timed_out:
+                continue
+            del self.running[task_id]
+            if timed_out:
+                self.fail(job, f"délai d'extraction dépassé ({self.timeout:.0f} s)")
+            else:
+                self.fail(job, "le processus d'extraction s'est arrêté")
+            self.replace(pid)
+
+    def run(self, documents, done):
+        """
+        Extrait les documents (nom, bytes) et appelle done(nom, nombre de pages, texte, erreur)
+        dans le processus principal, a mesure que les fichiers se terminent
+        """
+        documents = iter(documents)
+        inflight = []
+
+        def fill():
+            while len(inflight) < self.workers:
+                item = next(documents, None)
+                if item is None:
+                    return
+                if not self.processes:
+                    self.start()
+                job = {"name": item[0], "data": item[1], "count": None, "parts": {},
+                       "pending": set(), "error": None, "deadline": None}
+                inflight.append(job)
+                self.submit(job, 0, extract_document, (job["data"], self.pages_per_task))
+
+        try:
+            fill()
+            while inflight:
+                self.dispatch()
+                try:
+                    self.handle(*self.results.get(timeout=0.5))
+                except queue.Empty:
+                    pass
+                self.check_running()
+                for job in [job for job in inflight if not job["pending"]]:
+                    inflight.remove(job)
+                    if job["error"] is not None:
+                        done(job["name"], None, None, job["error"])
+                    else:
+                        done(job["name"], job["count"], "".join(job["parts"][i] for i in sorted(job["parts"])), None)
+                fill()
+            for worker in self.processes.values():
+                worker["tasks"].put(None)
+            for worker in self.processes.values():
+                worker["process"].join(timeout=5)
+        finally:
+            self.terminate()
+
+    def terminate(self):
+        for worker in self.processes.values():
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+        for worker in self.processes.values():
+            worker["process"].join()
+        self.processes = {}
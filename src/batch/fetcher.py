@@ -0,0 +1,128 @@
+import os
+import json
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Telechargements simultanes au total, et par hote (politesse envers les sites sources)
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+FETCH_PER_HOST = int(os.getenv("FETCH_PER_HOST", "2"))
+# Nouvelles tentatives (erreurs reseau, 429, 5xx) avec attente exponentielle: backoff * 2^n secondes
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", "0.5"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "30"))
+# Taille des blocs lus sur le reseau et ecrits tels quels dans ADLS
+FETCH_CHUNK_SIZE = int(os.getenv("FETCH_CHUNK_SIZE", str(4 * 1024 * 1024)))
+# ETag / Last-Modified de chaque URL telechargee, conserves dans ADLS entre deux executions
+FETCH_CACHE_FILE = "fetch_cache.json"
+
+def load_fetch_cache(file_system_client):
+    """Charge le cache des en-tetes de validation depuis ADLS (vide s'il n'existe pas encore)"""
+    try:
+        file_client = file_system_client.get_file_client(FETCH_CACHE_FILE)
+        if hasattr(file_client, "read_file"):
+            downloader = file_client.read_file()
+        else:
+            downloader = file_client.download_file()
+        return json.loads(downloader.readall().decode("utf-8"))["urls"]
+    except Exception:
+        return {}
+
+class DocumentFetcher:
+    """
+    Telechargements concurrents avec requetes conditionnelles
+
+    Une session (pool de connexions keep-alive) et une limite de concurrence par hote.
+    cache: {url: {"etag", "last_modified", "filename"}} des telechargements precedents,
+    renvoyes en If-None-Match / If-Modified-Since: un document inchange repond 304 sans corps.
+    """
+
+    def __init__(self, headers=None, cache=None, workers=FETCH_WORKERS, per_host=FETCH_PER_HOST):
+        self.headers = headers or {}
+        self.cache = dict(cache or {})
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.sessions = {}
+        self.limits = {}
+        self.lock = threading.Lock()
+
+    def host(self, url):
+        return urlparse(url).netloc.lower()
+
+    def session(self, host):
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                retry = Retry(
+                    total=FETCH_RETRIES,
+                    backoff_factor=FETCH_BACKOFF,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(["GET", "HEAD"]),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.per_host, max_retries=retry)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.sessions[host] = session
+                self.limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self.sessions[host], self.limits[host]
+
+    def conditional_headers(self, url):
+        entry = self.cache.get(url) or {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def fetch(self, url, handle):
+        """
+        Telecharge une URL; handle(url, response) consomme le corps d'une reponse 200
+
+        handle retourne le nom du fichier enregistre (None si rien n'a ete enregistre).
+
+        Returns:
+            ("unchanged", None) sur 304, ("fetched", nom) ou ("error", exception)
+        """
+        host = self.host(url)
+        session, limit = self.session(host)
+        with limit:
+            try:
+                response = session.get(url, headers=self.conditional_headers(url), stream=True, timeout=FETCH_TIMEOUT)
+            except requests.RequestException as e:
+                return "error", e
+            with response:
+                if response.status_code == 304:
+                    return "unchanged", None
+                try:
+                    response.raise_for_status()
+                    filename = handle(url, response)
+                except Exception as e:
+                    return "error", e
+        if filename is not None:
+            with self.lock:
+                self.cache[url] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "filename": filename,
+                }
+        return "fetched", filename
+
+    def fetch_all(self, urls, handle):
+        """Telecharge toutes les URLs en parallele, retourne {url: (statut, resultat)}"""
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return dict(zip(urls, pool.map(lambda url: self.fetch(url, handle), urls)))
+
+    def to_json(self):
+        return json.dumps({"urls": self.cache}, ensure_ascii=False)
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
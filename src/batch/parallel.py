@@ -0,0 +1,133 @@
+import os
+import queue
+import threading
+import multiprocessing
+
+# Processus d'encodage (1 = encodage dans le processus principal, sans pool)
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "1"))
+# Segments par tache envoyee a un processus, et taches en attente par file (0 = 2 par processus)
+INDEX_TASK_SIZE = int(os.getenv("INDEX_TASK_SIZE", "256"))
+INDEX_QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", "0"))
+
+def encode_worker(tasks, results, batch_size, threads):
+    """Boucle d'un processus d'encodage: un modele par processus, charge une seule fois"""
+    from embeddings import load_embedding_model
+    # Chaque processus se limite a sa part des coeurs (passe explicitement: EMBEDDING_THREADS
+    # a deja ete lu quand spawn a reimporte le script principal)
+    model = load_embedding_model(threads=threads)
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            results.put(None)
+            return
+        try:
+            embeddings = model.encode([chunk for _, chunk, _ in batch], batch_size=batch_size, convert_to_numpy=True)
+            results.put((batch, embeddings))
+        except Exception as e:
+            results.put((None, f"{type(e).__name__}: {e}"))
+
+class ParallelEncoder:
+    """
+    Encode les segments sur plusieurs processus et les remet a un seul ecrivain
+
+    Le processus principal decoupe et classe les segments, les processus du pool les
+    encodent, et un thread ecrivain du processus principal est le seul a ecrire dans
+    Chroma. Les files sont bornees: le decoupage attend quand l'encodage est sature,
+    et l'encodage attend quand l'ecriture prend du retard.
+    """
+
+    def __init__(self, write, workers=INDEX_WORKERS, batch_size=64, task_size=INDEX_TASK_SIZE,
+                 queue_size=INDEX_QUEUE_SIZE):
+        self.write = write
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.task_size = max(1, task_size)
+        self.queue_size = queue_size or 2 * self.workers
+        self.processes = []
+        self.written = 0
+        self.error = None
+
+    def start(self):
+        """Demarre le pool et l'ecrivain (au premier envoi: rien a charger si aucun fichier n'a change)"""
+        # spawn: torch ne supporte pas d'etre herite par fork
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue(self.queue_size)
+        self.results = context.Queue(self.queue_size)
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.processes = [
+            context.Process(target=encode_worker, args=(self.tasks, self.results, self.batch_size, threads), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        print(f"Encodage parallele: {self.workers} processus, {threads} thread(s) chacun")
+
+    def alive(self):
+        return any(process.is_alive() for process in self.processes)
+
+    def _put(self, item):
+        # Attente bornee: un pool mort ne doit pas bloquer le decoupage indefiniment
+        while True:
+            try:
+                self.tasks.put(item, timeout=1)
+                return
+            except queue.Full:
+                if not self.alive():
+                    raise RuntimeError("Les processus d'encodage se sont arretes")
+
+    def submit(self, chunks):
+        """Envoie des segments (chunk_id, texte, metadonnees) a encoder, par taches de task_size"""
+        if self.error is not None:
+            raise RuntimeError(f"Échec de l'encodage parallèle: {self.error}")
+        if not self.processes:
+            self.start()
+        for start in range(0, len(chunks), self.task_size):
+            self._put(chunks[start:start + self.task_size])
+
+    def _write_loop(self):
+        finished = 0
+        while finished < len(self.processes):
+            try:
+                item = self.results.get(timeout=1)
+            except queue.Empty:
+                if not self.alive():
+                    self.error = self.error or "un processus d'encodage s'est arrete"
+                    return
+                continue
+            if item is None:
+                finished += 1
+                continue
+            batch, embeddings = item
+            if batch is None:
+                self.error = embeddings
+                continue
+            if self.error is not None:
+                continue
+            try:
+                self.write(batch, embeddings)
+                self.written += len(batch)
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+
+    def close(self):
+        """Attend la fin de l'encodage et des ecritures; leve une erreur si une tache a echoue"""
+        if not self.processes:
+            return self.written
+        for _ in self.processes:
+            self._put(None)
+        self.writer.join()
+        for process in self.processes:
+            process.join()
+        if self.error is not None:
+            raise RuntimeError(f"Échec de l'encodage parallèle: {self.error}")
+        return self.written
+
+    def terminate(self):
+        """Arret immediat du pool (erreur dans le processus principal)"""
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join()
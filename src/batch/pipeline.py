@@ -6,18 +6,18 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
 from scrap import TextScrapper
-from traitement import RetrievalPipeline, list_files_in_adls, ACCOUNT_NAME, FILESYSTEM
+from traitement import RetrievalPipeline, get_dls_client, pending_changes, FILESYSTEM
 
-def restart_api():
-    """Trigger API restart via webhook to reload data"""
+def reload_api():
+    """Trigger a hot index reload on the API (no process restart)"""
     try:
-        print("\n[PIPELINE] Triggering API restart...")
+        print("\n[PIPELINE] Triggering API index reload...")
         # Replace with your actual API URL
         api_url = "https://juridicai-api.ashyplant-4eb87a1a.westeurope.azurecontainerapps.io"
-        requests.post(f"{api_url}/admin/restart", timeout=5)
-        print("[PIPELINE] Restart signal sent!")
+        requests.post(f"{api_url}/admin/reload", timeout=5)
+        print("[PIPELINE] Reload signal sent!")
     except Exception as e:
-        print(f"[PIPELINE] Warning: Failed to trigger API restart: {e}")
+        print(f"[PIPELINE] Warning: Failed to trigger API reload: {e}")
 
 def run_pipeline():
     """Main pipeline orchestrator: scraping -> indexing"""
@@ -48,28 +48,27 @@ def run_pipeline():
     print(f"\nTotal new files detected and converted: {total_new_files}")
 
     # STEP 2: INDEXING (CONDITIONAL)
+    # The indexing manifest also catches files modified or deleted in clean_data
     print("\n" + "="*80)
-    if total_new_files > 0:
-        print("   NEW FILES DETECTED -> STARTING INDEXATION ".center(80))
+    if total_new_files > 0 or pending_changes(get_dls_client().get_file_system_client(FILESYSTEM)):
+        print("   CHANGES DETECTED -> STARTING INCREMENTAL INDEXATION ".center(80))
         print("="*80 + "\n")
         
         try:
             retrieval_pipeline = RetrievalPipeline()
             
-            file_list = list_files_in_adls(retrieval_pipeline.file_system, retrieval_pipeline.clean_data_dir)
+            # Only new or modified files are re-encoded, deleted files are removed from the index
+            stats = retrieval_pipeline.sync_index()
             
-            if not file_list:
-                print("Warning: No files found in clean_data despite detecting new files.")
+            if stats["added"] or stats["updated"] or stats["removed"]:
+                retrieval_pipeline.save_to_adls()
+                retrieval_pipeline.cleanup()
+                # Trigger API index reload after successful update
+                reload_api()
             else:
-                print(f"Indexing {len(file_list)} files...")
-                for file_name in file_list:
-                    retrieval_pipeline.index_text(file_name)
-            
-            retrieval_pipeline.save_to_adls()
-            retrieval_pipeline.cleanup()
-            
-            # Trigger API restart after successful update
-            restart_api()
+                print("No indexed content changed, database upload skipped.")
+                retrieval_pipeline.save_manifest()
+                retrieval_pipeline.cleanup()
             
             print("\n" + "="*80)
             print("   PIPELINE COMPLETED SUCCESSFULLY ".center(80))
@@ -85,7 +84,7 @@ def run_pipeline():
             sys.exit(1)
             
     else:
-        print("   NO NEW FILES -> INDEXING SKIPPED ".center(80))
+        print("   NO CHANGES -> INDEXING SKIPPED ".center(80))
         print("="*80 + "\n")
         print("Pipeline completed normally without database update.")
 
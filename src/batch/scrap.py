@@ -3,9 +3,10 @@ from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 import os 
 import re 
-from io import BytesIO
-from pypdf import PdfReader 
-from docx import Document
+import threading
+from dedup import DedupIndex, DEDUP_INDEX_FILE
+from fetcher import DocumentFetcher, FETCH_CACHE_FILE, FETCH_CHUNK_SIZE, load_fetch_cache
+from extraction import ParallelExtractor
 
 try:
     from azure.identity import ClientSecretCredential, DefaultAzureCredential
@@ -91,6 +92,32 @@ def upload_file_to_adls(file_system_client, file_path, file_data):
         print(f"Erreur lors de l'upload: {e}")
         return False
 
+def upload_stream_to_adls(file_system_client, file_path, chunks):
+    """Upload un flux de blocs vers ADLS, bloc par bloc (sans assembler le fichier en mémoire)"""
+    file_client = file_system_client.get_file_client(file_path)
+    try:
+        # Supprimer si existe déjà
+        try:
+            file_client.delete_file()
+        except Exception:
+            pass
+        file_client.create_file()
+        offset = 0
+        for chunk in chunks:
+            if chunk:
+                file_client.append_data(data=chunk, offset=offset, length=len(chunk))
+                offset += len(chunk)
+        file_client.flush_data(offset)
+        return True
+    except Exception as e:
+        print(f"Erreur lors de l'upload: {e}")
+        # Ne pas laisser un fichier partiel: il serait pris pour un document deja telecharge
+        try:
+            file_client.delete_file()
+        except Exception:
+            pass
+        return False
+
 def download_file_from_adls(file_system_client, file_path):
     """Télécharge un fichier depuis ADLS et retourne les bytes"""
     try:
@@ -184,6 +211,14 @@ class TextScrapper():
                 # Le dossier existe déjà, on continue
                 pass
 
+        # Empreintes des textes de clean_data (detection des doublons sans relire tout le dossier)
+        self.dedup = DedupIndex.load(self.file_system)
+
+    def save_dedup(self):
+        """Sauvegarde l'index des empreintes dans ADLS"""
+        if not write_text_to_adls(self.file_system, DEDUP_INDEX_FILE, self.dedup.to_json()):
+            print("Erreur lors de la sauvegarde de l'index des doublons")
+
     def get_text(self):
         
         try:
@@ -197,59 +232,89 @@ class TextScrapper():
             print("Erreur de l'url: ", e)
         
     
+    def document_filename(self, pdf_url, response):
+        """Nom du fichier dans raw_pdfs pour un document telecharge"""
+        # nom du fichier = dernière partie de l'URL
+        if ".docx" in pdf_url or "doc_num.php" in pdf_url:
+
+            # essayer de récupérer le vrai nom dans l'en-tête HTTP
+            cd = response.headers.get("Content-Disposition")
+
+            if cd:
+                # extraire le nom du fichier depuis l'en-tête
+                filename = re.findall('filename="?(.+)"?', cd)[0]
+            else:
+                # fallback si pas d'en-tête → créer un nom propre
+                filename = pdf_url.split("/")[-1]
+                filename = filename.replace("?", "_").replace("=", "_")  # retirer caractères interdits
+                if not filename.lower().endswith(".docx"):
+                    filename += ".docx"
+        else:
+            filename = pdf_url.split("/")[-1]
+
+        filename = filename.strip().strip('"').strip("'")
+        return re.sub(r'[<>:"/\\|?*]', '_',filename)
+
+    def save_document(self, pdf_url, response, file_list, known, claimed, lock):
+        """Enregistre le corps d'une réponse 200 dans raw_pdfs; retourne le nom du fichier (None si rien n'est enregistré)"""
+        filename = self.document_filename(pdf_url, response)
+        filepath = f"{self.raw_pdf}/{filename}"
+
+        # Deux liens vers le même fichier: un seul téléchargement
+        with lock:
+            if filename in claimed:
+                print(f"Text: {filename}, already downloaded.")
+                return None
+            claimed.add(filename)
+
+        if filename in file_list and not known:
+            # Fichier présent avant le cache: on garde ses en-têtes, la prochaine requête sera conditionnelle
+            print(f"Text: {filename}, already here.")
+            return filename
+
+        if not upload_stream_to_adls(self.file_system, filepath, response.iter_content(chunk_size=FETCH_CHUNK_SIZE)):
+            print(f"Erreur lors de la sauvegarde de {filename}")
+            return None
+        print(f"→ Sauvegardé dans {ACCOUNT_NAME}/{FILESYSTEM}/{filepath}")
+
+        if filename in file_list:
+            # Nouvelle version d'un document connu: supprimer l'ancien texte pour qu'il soit reconverti
+            root, extension = os.path.splitext(filename)
+            txt_path = f"{self.output_folder}/{filename.replace(extension, '.txt')}"
+            try:
+                self.file_system.get_file_client(txt_path).delete_file()
+            except Exception:
+                pass
+        return filename
+
     def download_text(self):
         self.get_text()
 
-        file_list = list_files_in_adls(self.file_system, self.raw_pdf)
+        file_list = set(list_files_in_adls(self.file_system, self.raw_pdf))
 
-        for pdf_url in self.pdf_urls:
-            print("Has recovered :", pdf_url)
-            try:
-                request = requests.get(pdf_url, stream=True)
-                request.raise_for_status()
-            except Exception as e:
-                print("Error web: ", e)
-                continue
+        # Un fichier supprimé de raw_pdfs doit être retéléchargé: pas de requête conditionnelle pour lui
+        cache = {url: entry for url, entry in load_fetch_cache(self.file_system).items()
+                 if entry.get("filename") in file_list}
+        fetcher = DocumentFetcher(self.headers, cache)
+        claimed, lock = set(), threading.Lock()
 
-            # nom du fichier = dernière partie de l'URL
-            if ".docx" in pdf_url or "doc_num.php" in pdf_url:
-
-                # essayer de récupérer le vrai nom dans l'en-tête HTTP
-                cd = request.headers.get("Content-Disposition")
-
-                if cd:
-                    # extraire le nom du fichier depuis l'en-tête
-                    filename = re.findall('filename="?(.+)"?', cd)[0]
-                else:
-                    # fallback si pas d'en-tête → créer un nom propre
-                    filename = pdf_url.split("/")[-1]
-                    filename = filename.replace("?", "_").replace("=", "_")  # retirer caractères interdits
-                    if not filename.lower().endswith(".docx"):
-                        filename += ".docx"
-            else:
-                filename = pdf_url.split("/")[-1]
-            
-            filename = filename.strip().strip('"').strip("'")
-            filename = re.sub(r'[<>:"/\\|?*]', '_',filename)
-            filepath = f"{self.raw_pdf}/{filename}"
+        def handle(pdf_url, response):
+            return self.save_document(pdf_url, response, file_list, pdf_url in cache, claimed, lock)
 
-            try:
-                if filename not in file_list:
-                    # Télécharger le fichier en mémoire
-                    file_data = b""
-                    for chunk in request.iter_content(chunk_size=8192):
-                        if chunk:
-                            file_data += chunk
-                    
-                    # Upload vers Azure
-                    if upload_file_to_adls(self.file_system, filepath, file_data):
-                        print(f"→ Sauvegardé dans {ACCOUNT_NAME}/{FILESYSTEM}/{filepath}")
-                    else:
-                        print(f"Erreur lors de la sauvegarde de {filename}")
-                else:
-                    print(f"Text: {filename}, already here.")
-            except Exception as e:
-                print("can't save:", e)
+        try:
+            results = fetcher.fetch_all(self.pdf_urls, handle)
+        finally:
+            fetcher.close()
+
+        for pdf_url, (status, result) in results.items():
+            print("Has recovered :", pdf_url)
+            if status == "unchanged":
+                print(f"Text: {cache[pdf_url]['filename']}, not modified.")
+            elif status == "error":
+                print("Error web: ", result)
+
+        if not write_text_to_adls(self.file_system, FETCH_CACHE_FILE, fetcher.to_json()):
+            print("Erreur lors de la sauvegarde du cache des téléchargements")
 
     def pdf_to_txt(self):
         """
@@ -280,70 +345,55 @@ class TextScrapper():
         error_count = 0
         
         # liste avec tout les nom des fichier texte de before_clean_data
-        text_list = list_files_in_adls(self.file_system, self.output_folder)
+        text_list = set(list_files_in_adls(self.file_system, self.output_folder))
+
+        positions = {pdf_name: i for i, pdf_name in enumerate(pdf_files, 1)}
+
+        def documents():
+            """PDFs sans texte, téléchargés au fur et à mesure que le pool les consomme"""
+            nonlocal success_count, error_count
+            for i, pdf_name in enumerate(pdf_files, 1):
+                root, extension = os.path.splitext(pdf_name)
+                txt_name = pdf_name.replace(extension, '.txt')
+                if txt_name in text_list:
+                    print(f"[{i}/{len(pdf_files)}]  {txt_name} existe déjà, ignoré.\n")
+                    success_count += 1
+                    continue
 
-        # Convertir chaque PDF
-        for i, pdf_name in enumerate(pdf_files, 1):
-            pdf_adls_path = f"{self.raw_pdf}/{pdf_name}"
-            root, extension = os.path.splitext(pdf_name)
-            
-            try:
                 # Télécharger le fichier depuis Azure
-                pdf_bytes = download_file_from_adls(self.file_system, pdf_adls_path)
+                pdf_bytes = download_file_from_adls(self.file_system, f"{self.raw_pdf}/{pdf_name}")
                 if pdf_bytes is None:
                     print(f"[{i}/{len(pdf_files)}]  Erreur lors du téléchargement : {pdf_name}\n")
                     error_count += 1
                     continue
-                
-                txt_name = pdf_name.replace(extension, '.txt')
-                output_path = f"{self.output_folder}/{txt_name}"
-                
-                if txt_name not in text_list:
-                    print(f"[{i}/{len(pdf_files)}]  Conversion de : {pdf_name}")
-                    
-                    text = ""
-                    pages_count = 0
-                    
-                    # Essayer PDF d'abord
-                    try:
-                        reader = PdfReader(BytesIO(pdf_bytes))
-                        pages_count = len(reader.pages)
-                        # Extraire le texte de toutes les pages
-                        for page_num, page in enumerate(reader.pages, 1):
-                            page_text = page.extract_text() or ""
-                            text += page_text
-                        
-                    except Exception:
-                        # Si ce n'est pas un PDF, essayer DOCX
-                        try:
-                            doc = Document(BytesIO(pdf_bytes))
-                            text = ""
-                            for paragraph in doc.paragraphs:
-                                text += paragraph.text + "\n"
-                            pages_count = len(doc.paragraphs)  # Approximation
-                        except Exception as e:
-                            print(f"    Erreur: format non supporté ou fichier corrompu: {e}")
-                            error_count += 1
-                            continue
-                    
-                    # Écrire le texte dans Azure
-                    if write_text_to_adls(self.file_system, output_path, text):
-                        chars_count = len(text)
-                        print(f"    Converti avec succès : {txt_name}")
-                        print(f"    Pages : {pages_count} | Caractères : {chars_count:,}\n")
-                        success_count += 1
-                        self.new_files_count += 1 # Incrémenter le compteur global
-                    else:
-                        print(f"    Erreur lors de l'écriture du fichier\n")
-                        error_count += 1
-                else:
-                    print(f"[{i}/{len(pdf_files)}]  {txt_name} existe déjà, ignoré.\n")
-                    success_count += 1
-                
-            except Exception as e:
-                print(f"  Erreur lors de la conversion : {str(e)}\n")
+                yield pdf_name, pdf_bytes
+
+        def converted(pdf_name, pages_count, text, error):
+            nonlocal success_count, error_count
+            root, extension = os.path.splitext(pdf_name)
+            txt_name = pdf_name.replace(extension, '.txt')
+            output_path = f"{self.output_folder}/{txt_name}"
+
+            print(f"[{positions[pdf_name]}/{len(pdf_files)}]  Conversion de : {pdf_name}")
+            if error is not None:
+                print(f"    Erreur: {error}")
                 error_count += 1
-        
+                return
+
+            # Écrire le texte dans Azure
+            if write_text_to_adls(self.file_system, output_path, text):
+                chars_count = len(text)
+                print(f"    Converti avec succès : {txt_name}")
+                print(f"    Pages : {pages_count} | Caractères : {chars_count:,}\n")
+                success_count += 1
+                self.new_files_count += 1 # Incrémenter le compteur global
+            else:
+                print(f"    Erreur lors de l'écriture du fichier\n")
+                error_count += 1
+
+        # Extraction sur un pool de processus (par fichier, et par plages de pages pour les gros PDF)
+        ParallelExtractor().run(documents(), converted)
+
         # Résumé final
         print(f"{'='*80}")
         print(f"   RÉSUMÉ DE LA CONVERSION ".center(80))
@@ -356,6 +406,7 @@ class TextScrapper():
 
     def clean_text(self):
         text_path = list_files_in_adls(self.file_system, self.output_folder)
+        clean_list = set(list_files_in_adls(self.file_system, self.final_folder))
 
         for text_name in text_path:
             text_directory = f"{self.output_folder}/{text_name}"
@@ -389,43 +440,58 @@ class TextScrapper():
 
             clean_text_directory = f"{self.final_folder}/{text_name}"
 
+            # un hash et une recherche dans l'index: doublon d'un texte deja nettoye ?
+            entry = self.dedup.entry(text_to_clean)
+            original = self.dedup.find_duplicate(text_name, entry)
+            if original is not None:
+                print(f"{text_name} est un doublon de {original}, ignoré.")
+                if text_name in clean_list and delete_file_from_adls(self.file_system, clean_text_directory):
+                    print(f"File {ACCOUNT_NAME}/{FILESYSTEM}/{clean_text_directory} removed")
+                self.dedup.remove(text_name)
+                continue
+
+            # texte inchange: pas de reecriture (l'indexation le reconnait a son etag)
+            known = self.dedup.files.get(text_name)
+            if text_name in clean_list and known is not None and known["sha256"] == entry["sha256"]:
+                self.dedup.add(text_name, entry)
+                continue
+
             # Écrire le texte nettoyé dans Azure
-            if not write_text_to_adls(self.file_system, clean_text_directory, text_to_clean):
+            if write_text_to_adls(self.file_system, clean_text_directory, text_to_clean):
+                self.dedup.add(text_name, entry)
+            else:
                 print(f"Erreur lors de l'écriture de {text_name}")
 
+        self.save_dedup()
+
     def clone_verifie(self):
         # verifie les si il y a des texte en double et les supprime
+        # seuls les fichiers absents de l'index des empreintes sont relus (un hash chacun)
 
         text_list = list_files_in_adls(self.file_system, self.final_folder)
 
-        # recupere tout les texte
-        for i, text_file in enumerate(text_list):
-            try:
-                text_directory = f"{self.final_folder}/{text_file}"
-                text = read_text_from_adls(self.file_system, text_directory)
-                if text is None:
-                    continue
-            except:
+        # oublie les fichiers retires de clean_data
+        present = set(text_list)
+        for name in [n for n in self.dedup.files if n not in present]:
+            self.dedup.remove(name)
+
+        for text_file in text_list:
+            if self.dedup.complete(text_file):
                 continue
-            
-            counter = 0
-            for n in text_list:
-                try:
-                    text_directory_b = f"{self.final_folder}/{n}"
-                    text_b = read_text_from_adls(self.file_system, text_directory_b)
-                    if text_b is None:
-                        continue
-
-                    if text == text_b and counter == 0:
-                        counter += 1
-                    elif text == text_b and counter > 0:
-                        if delete_file_from_adls(self.file_system, text_directory_b):
-                            print(f"File {ACCOUNT_NAME}/{FILESYSTEM}/{text_directory_b} removed")
-                except:
-                    pass
-
-                
-        
+            text_directory = f"{self.final_folder}/{text_file}"
+            text = read_text_from_adls(self.file_system, text_directory)
+            if text is None:
+                continue
+
+            entry = self.dedup.entry(text)
+            original = self.dedup.find_duplicate(text_file, entry)
+            if original is None:
+                self.dedup.add(text_file, entry)
+            elif delete_file_from_adls(self.file_system, text_directory):
+                print(f"File {ACCOUNT_NAME}/{FILESYSTEM}/{text_directory} removed (doublon de {original})")
+
+        self.save_dedup()
+
 if __name__ == "__main__":
     # tout les site qu on veut scraper
     # peut avoir les url que vous vouler
@@ -1,11 +1,14 @@
-import chromadb 
-from sentence_transformers import SentenceTransformer
+from classifier import CategoryClassifier
+from parallel import ParallelEncoder, INDEX_WORKERS
 import os
 from pathlib import Path
 import json
 import re
+import hashlib
 import tempfile
 import shutil
+import threading
+from datetime import datetime, timezone
 
 try:
     from azure.identity import ClientSecretCredential, DefaultAzureCredential
@@ -33,6 +36,12 @@ CLEAN_DIR = "clean_data"
 JSON_FILE = "base_dechets.json"
 # ---------------------------------------
 
+# Taille des lots d'encodage, et nombre de chunks ecrits par appel Chroma (une transaction)
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+INDEX_WRITE_BATCH = int(os.getenv("INDEX_WRITE_BATCH", "1000"))
+# Manifeste d'indexation dans ADLS: fichier -> hash du contenu, etag, identifiants des segments
+INDEX_MANIFEST_FILE = "index_manifest.json"
+
 def get_dls_client():
     """Crée et retourne un client Azure Data Lake Storage"""
     if not ACCOUNT_NAME or not FILESYSTEM:
@@ -137,10 +146,67 @@ def read_text_from_adls(file_system_client, file_path):
         print(f"Erreur lors de la lecture: {e}")
         return None
 
+def list_file_etags(file_system_client, directory_path):
+    """Liste les fichiers d'un répertoire ADLS avec leur etag (vide si non fourni)"""
+    try:
+        return {
+            os.path.basename(p.name): str(getattr(p, "etag", "") or "")
+            for p in file_system_client.get_paths(path=directory_path)
+            if not p.is_directory and p.name.startswith(directory_path + "/")
+        }
+    except Exception:
+        return {}
+
+def write_text_to_adls(file_system_client, file_path, text):
+    """Écrit (ou remplace) un fichier texte dans ADLS"""
+    data = text.encode("utf-8")
+    file_client = file_system_client.get_file_client(file_path)
+    file_client.create_file()
+    file_client.append_data(data, offset=0, length=len(data))
+    file_client.flush_data(len(data))
+
+def load_index_manifest(file_system_client):
+    """Charge le manifeste d'indexation depuis ADLS, None s'il n'existe pas encore"""
+    try:
+        file_client = file_system_client.get_file_client(INDEX_MANIFEST_FILE)
+        if hasattr(file_client, "read_file"):
+            downloader = file_client.read_file()
+        else:
+            downloader = file_client.download_file()
+        return json.loads(downloader.readall().decode("utf-8"))
+    except Exception:
+        return None
+
+def save_index_manifest(file_system_client, manifest):
+    """Sauvegarde le manifeste d'indexation dans ADLS"""
+    write_text_to_adls(file_system_client, INDEX_MANIFEST_FILE, json.dumps(manifest, ensure_ascii=False))
+
+def pending_changes(file_system_client, directory_path=CLEAN_DIR):
+    """
+    Indique, sans ouvrir Chroma, si clean_data a changé depuis la dernière indexation
+
+    Compare la liste des fichiers (et leurs etags) au manifeste: fichier ajouté,
+    modifié ou supprimé, ou manifeste absent.
+    """
+    manifest = load_index_manifest(file_system_client)
+    if manifest is None:
+        return True
+    listing = list_file_etags(file_system_client, directory_path)
+    files = manifest["files"]
+    if set(listing) != set(files):
+        return True
+    return any(not etag or files[name].get("etag") != etag for name, etag in listing.items())
+
 class RetrievalPipeline:
     def __init__(self):
-        # Initialise le modèle SentenceTransformer pour les embeddings de texte
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Initialise le modèle d'embedding (backend choisi par EMBEDDING_BACKEND);
+        # en mode parallèle chaque processus d'encodage charge le sien
+        self.workers = INDEX_WORKERS
+        # Imports differes: les processus spawn (encodage, extraction) reimportent le script principal
+        # et ne doivent pas charger torch et chromadb pour rien
+        from embeddings import load_embedding_model
+        import chromadb
+        self.model = load_embedding_model() if self.workers <= 1 else None
 
         #base du projet ou ce fichier ce trouve
         self.base_dir = Path(__file__).resolve().parent
@@ -167,11 +233,33 @@ class RetrievalPipeline:
         self.chroma_client = chromadb.PersistentClient(path=self.local_db_path)
         # Récupère ou crée une collection dans la base appelée "law_text"
         self.collection = self.chroma_client.get_or_create_collection(name="law_text")
+        # Vocabulaire des categories, lu une seule fois par execution
+        self._classifier = None
+        # Seul le processus principal ecrit dans la collection (thread ecrivain + suppressions)
+        self.write_lock = threading.Lock()
+        # Manifeste d'indexation: fichiers deja indexes sans relire la collection
+        self.manifest = load_index_manifest(self.file_system)
+        self.bootstrap_ids = None
+        if self.manifest is None:
+            # Premier passage: les segments deja presents dans Chroma sont repris tels quels
+            self.bootstrap_ids = set(self.collection.get(include=[])["ids"])
+            self.manifest = {"next_chunk_id": len(self.bootstrap_ids), "files": {}}
 
     def save_to_adls(self):
         """Sauvegarde la base de données locale vers ADLS"""
+        # Nouvelle version d'index: invalide les caches de reponses cote serveur
+        metadata = {k: v for k, v in (self.collection.metadata or {}).items() if not k.startswith("hnsw:")}
+        metadata["index_version"] = datetime.now(timezone.utc).isoformat()
+        self.collection.modify(metadata=metadata)
+
         print("Sauvegarde: Upload de la base Chroma vers ADLS...")
-        upload_directory(self.file_system, self.local_db_path, self.remote_db_path)
+        if upload_directory(self.file_system, self.local_db_path, self.remote_db_path):
+            # Le manifeste ne doit decrire que ce qui a ete effectivement publie
+            self.save_manifest()
+
+    def save_manifest(self):
+        """Sauvegarde le manifeste d'indexation vers ADLS"""
+        save_index_manifest(self.file_system, self.manifest)
 
     def cleanup(self):
         """Nettoie le dossier temporaire"""
@@ -181,31 +269,19 @@ class RetrievalPipeline:
         except Exception as e:
             print(f"Erreur lors du nettoyage: {e}")
 
+    @property
+    def classifier(self):
+        """Classifieur compile depuis base_dechets.json (ADLS), charge a la premiere utilisation"""
+        if self._classifier is None:
+            json_content = read_text_from_adls(self.file_system, self.json_file_path)
+            if json_content is None:
+                raise SystemExit(f"Impossible de lire {self.json_file_path} depuis ADLS.")
+            self._classifier = CategoryClassifier.from_json(json_content)
+        return self._classifier
+
     def find_category(self, text):
-        # trouve la categorie aproximatif
-        
-        # recupere le dic dans base_dechets.json depuis ADLS
-        json_content = read_text_from_adls(self.file_system, self.json_file_path)
-        if json_content is None:
-            raise SystemExit(f"Impossible de lire {self.json_file_path} depuis ADLS.")
-        category = json.loads(json_content)
-        # cree un dic avec les meme cle que l original
-        dominent_category = {key:0 for key in category}
-        # parcour chaque cle de category
-        for key,data in category.items():
-            # recupere les poid de chaque categorie
-            weight = data["weight"]
-            total = 0
-            for word in data["keywords"]:
-                #pour chaque partie de texte conte l'aparition des mot en ajoutent le poid
-                pattern = r"\b" + word + r"\b"
-                total += len(re.findall(pattern, text))
-                dominent_category[key] = total * weight
-        
-        # la categorie qui apparait le plus
-        dominent = max(dominent_category, key=dominent_category.get)
-        # return la categorie
-        return dominent
+        # trouve la categorie aproximatif (mot-cles ponderes de base_dechets.json)
+        return self.classifier.classify(text)
 
     def chunking(self, text, chunk_size=450, overlap=50):
         # Divise un texte long en petits segments qui se chevauchent pour une meilleure qualité d’embedding
@@ -223,22 +299,18 @@ class RetrievalPipeline:
 
         return chunks
 
-    def index_text(self, file_name):
+    def prepare_chunks(self, file_name, text_law, first_idx):
         """
-        Indexe un fichier texte depuis ADLS
-        
+        Découpe le texte d'un fichier, sans encoder
+
         Args:
             file_name: Nom du fichier dans le dossier clean_data (ex: "document.txt")
-        """
-        # Construit le chemin complet dans ADLS
-        adls_file_path = f"{self.clean_data_dir}/{file_name}"
-        
-        # Lit le contenu du fichier texte depuis ADLS
-        text_law = read_text_from_adls(self.file_system, adls_file_path)
-        if text_law is None:
-            print(f"Erreur: Impossible de lire {file_name} depuis ADLS.")
-            return
+            text_law: Contenu du fichier
+            first_idx: Base de la numérotation chunk_id du fichier
 
+        Returns:
+            Liste de (chunk_id, texte, métadonnées) pour tous les segments du fichier
+        """
         # Divise le texte en segments
         chunks = self.chunking(text_law)
         # Récupère le nom du fichier (sans extension) pour l'utiliser comme identifiant unique
@@ -255,53 +327,181 @@ class RetrievalPipeline:
             date = match.group(0)
         else:
             date="unknow"
-        # Récupère les identifiants de documents existants dans la collection Chroma pour éviter les doublons
-        existing_ids = set(self.collection.get()["ids"])
-        new_chunks = 0
-        
-        idx = len(existing_ids)
 
-        # Boucle sur tous les segments du fichier
-        for i, chunk in enumerate(chunks):
-            idx += 1
+        # recupere les categories de tous les segments en un seul passage
+        categories = self.classifier.classify_batch(chunks)
+
+        new_chunks = []
+        for i, (chunk, category) in enumerate(zip(chunks, categories)):
             # Crée un identifiant unique pour chaque segment basé sur le nom du fichier et son index
-            chunk_id = f"{file_id}_chunk_{i}" 
-            # recupere la categorie
-            category = self.find_category(chunk)
-            # Passe ce segment s’il est déjà indexé
-            if chunk_id in existing_ids:
-                continue
-            
-            # Génère un embedding pour le segment à l’aide du modèle
-            embedding = self.model.encode(chunk, convert_to_numpy=True)
-            # Ajoute le segment, son embedding et ses métadonnées (chemin du fichier) à la collection
-            self.collection.add(
-                ids=[chunk_id],
-                documents=[chunk],
-                embeddings=[embedding],
-                metadatas=[{"source": file_id, "categorie": category, "date": date, "chunk_id":idx}]
+            chunk_id = f"{file_id}_chunk_{i}"
+            metadata = {"source": file_id, "categorie": category, "date": date, "chunk_id": first_idx + i + 1}
+            new_chunks.append((chunk_id, chunk, metadata))
+        return new_chunks
+
+    def store_chunks(self, batch, embeddings):
+        """Écrit dans Chroma des segments déjà encodés, en une écriture groupée"""
+        with self.write_lock:
+            # upsert: un fichier modifié réécrit ses segments sous les mêmes identifiants
+            self.collection.upsert(
+                ids=[chunk_id for chunk_id, _, _ in batch],
+                documents=[chunk for _, chunk, _ in batch],
+                embeddings=embeddings,
+                metadatas=[metadata for _, _, metadata in batch]
             )
-            new_chunks += 1
+
+    def write_chunks(self, new_chunks):
+        """Encode les segments par lots et les écrit dans Chroma en écritures groupées"""
+        for start in range(0, len(new_chunks), INDEX_WRITE_BATCH):
+            batch = new_chunks[start:start + INDEX_WRITE_BATCH]
+            # Un passage du modèle par lot de INDEX_BATCH_SIZE segments
+            embeddings = self.model.encode([chunk for _, chunk, _ in batch], batch_size=INDEX_BATCH_SIZE, convert_to_numpy=True)
+            self.store_chunks(batch, embeddings)
+
+    def delete_chunks(self, chunk_ids):
+        """Supprime des segments de la collection, par paquets"""
+        chunk_ids = sorted(chunk_ids)
+        with self.write_lock:
+            for start in range(0, len(chunk_ids), INDEX_WRITE_BATCH):
+                self.collection.delete(ids=chunk_ids[start:start + INDEX_WRITE_BATCH])
+
+    def sync_index(self, listing=None, remove_missing=True):
+        """
+        Met à jour l'index de façon incrémentale à partir du manifeste
+
+        - fichiers inchangés (même etag, ou même hash de contenu): ignorés sans toucher à Chroma
+        - fichiers nouveaux ou modifiés: redécoupés, encodés par lots et upsertés;
+          les segments qui n'existent plus sont supprimés
+        - fichiers retirés de clean_data: leurs segments sont supprimés de la collection
+
+        Avec INDEX_WORKERS > 1, l'encodage est réparti sur un pool de processus pendant que
+        ce processus continue le découpage et la classification des fichiers suivants.
+
+        Args:
+            listing: {nom de fichier: etag}, par défaut tout le dossier clean_data
+            remove_missing: supprime les fichiers du manifeste absents de listing
+
+        Returns:
+            Compteurs {"added", "updated", "removed", "unchanged", "chunks"}
+        """
+        if listing is None:
+            listing = list_file_etags(self.file_system, self.clean_data_dir)
+        files = self.manifest["files"]
+        stats = dict.fromkeys(["added", "updated", "removed", "unchanged", "chunks"], 0)
+        encoder = None
+        if self.workers > 1:
+            # Pool demarre au premier fichier a encoder
+            encoder = ParallelEncoder(self.store_chunks, self.workers, INDEX_BATCH_SIZE)
+        try:
+            self.index_listing(listing, stats, encoder.submit if encoder is not None else self.write_chunks)
+            if encoder is not None:
+                encoder.close()
+        except BaseException:
+            if encoder is not None:
+                encoder.terminate()
+            raise
+
+        if remove_missing:
+            for file_name in [name for name in files if name not in listing]:
+                print(f"Suppression de l'index: {file_name}")
+                self.delete_chunks(files.pop(file_name)["chunk_ids"])
+                stats["removed"] += 1
+
+        print(
+            f"Indexation terminée: {stats['added']} ajouté(s), {stats['updated']} modifié(s), "
+            f"{stats['removed']} supprimé(s), {stats['unchanged']} inchangé(s), {stats['chunks']} segment(s) écrit(s)"
+        )
+        return stats
+
+    def index_listing(self, listing, stats, flush):
+        """Envoie à flush, par paquets, les segments des fichiers nouveaux ou modifiés du listing"""
+        files = self.manifest["files"]
+        pending = []
+        for file_name, etag in listing.items():
+            entry = files.get(file_name)
+            if entry is not None and etag and entry.get("etag") == etag:
+                stats["unchanged"] += 1
+                continue
+
+            # Construit le chemin complet dans ADLS et lit le contenu du fichier
+            text_law = read_text_from_adls(self.file_system, f"{self.clean_data_dir}/{file_name}")
+            if text_law is None:
+                print(f"Erreur: Impossible de lire {file_name} depuis ADLS.")
+                continue
+            digest = hashlib.sha256(text_law.encode("utf-8")).hexdigest()
+            if entry is not None and entry["hash"] == digest:
+                entry["etag"] = etag
+                stats["unchanged"] += 1
+                continue
+
+            chunks = self.prepare_chunks(file_name, text_law, self.manifest["next_chunk_id"])
+            chunk_ids = [chunk_id for chunk_id, _, _ in chunks]
+            record = {"hash": digest, "etag": etag, "chunk_ids": chunk_ids}
+            if entry is None and self.bootstrap_ids is not None and self.bootstrap_ids.issuperset(chunk_ids):
+                # Deja indexe avant l'introduction du manifeste: rien a reencoder
+                files[file_name] = record
+                stats["unchanged"] += 1
+                continue
+
+            print(f"Indexation de: {file_name}")
+            self.manifest["next_chunk_id"] += len(chunks)
+            if entry is not None:
+                stale = set(entry["chunk_ids"]) - set(chunk_ids)
+                if stale:
+                    self.delete_chunks(stale)
+            files[file_name] = record
+            stats["updated" if entry is not None else "added"] += 1
+
+            pending.extend(chunks)
+            if len(pending) >= INDEX_WRITE_BATCH:
+                flush(pending)
+                stats["chunks"] += len(pending)
+                pending = []
+        if pending:
+            flush(pending)
+            stats["chunks"] += len(pending)
+
+    def index_files(self, file_names):
+        """
+        Indexe plusieurs fichiers texte depuis ADLS (les fichiers inchangés sont ignorés)
+
+        Args:
+            file_names: Noms des fichiers dans le dossier clean_data
+
+        Returns:
+            Nombre de segments écrits
+        """
+        return self.sync_index({file_name: "" for file_name in file_names}, remove_missing=False)["chunks"]
+
+    def index_text(self, file_name):
+        """
+        Indexe un fichier texte depuis ADLS
+        
+        Args:
+            file_name: Nom du fichier dans le dossier clean_data (ex: "document.txt")
+        """
+        return self.index_files([file_name])
 
 if __name__ == "__main__":
     # Initialise le pipeline de recherche
     retrieval_pipeline = RetrievalPipeline()
     
     try:
-        # Parcourt tous les fichiers texte dans le dossier 'clean_data' depuis ADLS et les indexe
-        file_list = list_files_in_adls(retrieval_pipeline.file_system, retrieval_pipeline.clean_data_dir)
+        # Parcourt tous les fichiers texte dans le dossier 'clean_data' depuis ADLS et met l'index a jour
+        listing = list_file_etags(retrieval_pipeline.file_system, retrieval_pipeline.clean_data_dir)
         
-        if not file_list:
+        if not listing:
             print(f"Aucun fichier trouvé dans {ACCOUNT_NAME}/{FILESYSTEM}/{retrieval_pipeline.clean_data_dir}/")
             print("Assurez-vous que les fichiers ont été traités par scrap.py et sont disponibles dans ADLS.")
         else:
-            print(f"Trouvé {len(file_list)} fichier(s) à indexer dans {ACCOUNT_NAME}/{FILESYSTEM}/{retrieval_pipeline.clean_data_dir}/")
-            for file_name in file_list:
-                print(f"Indexation de: {file_name}")
-                retrieval_pipeline.index_text(file_name)
+            print(f"Trouvé {len(listing)} fichier(s) dans {ACCOUNT_NAME}/{FILESYSTEM}/{retrieval_pipeline.clean_data_dir}/")
+        stats = retrieval_pipeline.sync_index(listing)
         
-        # Sauvegarde finale vers ADLS
-        retrieval_pipeline.save_to_adls()
+        # Sauvegarde finale vers ADLS (le manifeste seul si la collection n'a pas change)
+        if stats["added"] or stats["updated"] or stats["removed"]:
+            retrieval_pipeline.save_to_adls()
+        else:
+            retrieval_pipeline.save_manifest()
         
     finally:
         # Nettoyage du dossier temporaire
@@ -0,0 +1,136 @@
+import os
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from metrics import ADMISSION_WAIT, ADMISSION_REJECTIONS
+
+# Generations Ollama simultanees par instance, requetes en attente au-dela, et attente maximale dans la file
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "4"))
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "32"))
+GENERATION_QUEUE_TIMEOUT = float(os.getenv("GENERATION_QUEUE_TIMEOUT", "20"))
+# Budget total d'une requete /search (secondes), attente en file comprise
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+
+class Overloaded(Exception):
+    """Raised when a generation cannot be admitted (queue full or deadline reached)"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+def request_deadline():
+    return time.monotonic() + REQUEST_DEADLINE_SECONDS
+
+def remaining(deadline, limit):
+    """Seconds left before the deadline, capped at limit (limit when there is no deadline)"""
+    if deadline is None:
+        return limit
+    return max(0.0, min(limit, deadline - time.monotonic()))
+
+class AdmissionController:
+    """Concurrency limit with a bounded wait queue in front of the generation backend"""
+
+    def __init__(self, max_concurrency=GENERATION_MAX_CONCURRENCY, max_queue=GENERATION_MAX_QUEUE,
+                 queue_timeout=GENERATION_QUEUE_TIMEOUT):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._semaphore = None
+        # Jetons a retirer du semaphore apres une baisse de la limite (voir resize)
+        self._excess = 0
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Duree moyenne (lissee) d'une generation, pour estimer Retry-After
+        self.service_time = 5.0
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def resize(self, max_concurrency):
+        """Changes the concurrency limit; above a lowered limit, slots are withdrawn as they free up"""
+        max_concurrency = max(1, max_concurrency)
+        delta = max_concurrency - self.max_concurrency
+        if delta == 0:
+            return
+        self.max_concurrency = max_concurrency
+        if self._semaphore is None:
+            return
+        if delta < 0:
+            self._excess -= delta
+            return
+        absorbed = min(delta, self._excess)
+        self._excess -= absorbed
+        for _ in range(delta - absorbed):
+            self._semaphore.release()
+
+    async def _acquire(self):
+        await self.semaphore.acquire()
+        # Limite abaissee: le jeton obtenu est retire, on en attend un autre
+        while self._excess > 0:
+            self._excess -= 1
+            await self.semaphore.acquire()
+
+    def retry_after(self):
+        waves = (self.waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(waves * self.service_time))
+
+    def reject(self, reason):
+        self.rejected += 1
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        raise Overloaded(reason, self.retry_after())
+
+    def check(self):
+        """Fast rejection before doing any work when the queue is already full"""
+        if self.active + self.waiting >= self.max_concurrency + self.max_queue:
+            self.reject("queue_full")
+
+    @asynccontextmanager
+    async def slot(self, deadline=None):
+        """Holds one generation slot; waits in the bounded queue, at most until the deadline"""
+        self.check()
+        timeout = self.queue_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            self.reject("deadline")
+
+        self.waiting += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.reject("timeout")
+        finally:
+            self.waiting -= 1
+            ADMISSION_WAIT.observe(time.monotonic() - start)
+
+        self.active += 1
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            if self._excess > 0:
+                self._excess -= 1
+            else:
+                self.semaphore.release()
+            self.service_time = 0.9 * self.service_time + 0.1 * (time.monotonic() - started)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "service_time_seconds": round(self.service_time, 3),
+        }
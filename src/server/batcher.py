@@ -0,0 +1,77 @@
+import os
+import asyncio
+
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+# Attente maximale (ms) pour laisser d'autres requetes rejoindre le lot
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+class EmbeddingBatcher:
+    """Coalesces concurrent encode calls into batched model forward passes"""
+
+    def __init__(self, model, max_batch_size=EMBED_BATCH_MAX_SIZE, max_wait_ms=EMBED_BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.queue = None
+        self._worker = None
+        self.batches = 0
+        self.encoded = 0
+
+    def _ensure_started(self):
+        # La file et la tache sont creees dans la boucle d'evenements qui sert les requetes
+        if self._worker is None or self._worker.done():
+            self.queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def encode(self, text):
+        """Returns the embedding of one text, computed together with concurrent callers"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((text, future))
+        return await future
+
+    def _drain(self, batch):
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            self._drain(batch)
+            if len(batch) < self.max_batch_size and self.max_wait > 0:
+                await asyncio.sleep(self.max_wait)
+                self._drain(batch)
+
+            # Les appelants annules (client deconnecte) ne sont pas encodes
+            batch = [(text, future) for text, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await asyncio.to_thread(
+                    self.model.encode, texts, batch_size=len(texts), convert_to_numpy=True
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.encoded += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    async def aclose(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "mean_batch_size": round(self.encoded / self.batches, 2) if self.batches else 0.0,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+        }
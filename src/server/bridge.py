@@ -1,10 +1,36 @@
-from fastapi import FastAPI
+import os
+import json
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from reponse import Generation
+from query_search import N_RESULTS
 from datetime import date
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from metrics import REQUEST_LATENCY, log_sampled, register_stats
+from admission import Overloaded, request_deadline
 
-app = FastAPI()
+# Nombre maximal de questions par appel a /search/batch
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+
+model = Generation()
+register_stats("rag_cache", model.cache.stats)
+register_stats("rag_generation_admission", model.admission.stats)
+register_stats("ollama_pool", model.pool.stats, label="host")
+if model.pipeline.batcher is not None:
+    register_stats("rag_embedding_batcher", model.pipeline.batcher.stats)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    model.start()
+    yield
+    # Ferme proprement les pools de connexions vers Ollama
+    await model.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,42 +40,217 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-model = Generation()
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # Rejet rapide: le client reessaie plus tard au lieu d'attendre un timeout
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service surchargé, veuillez réessayer.", "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 class Query(BaseModel):
     query: str
 
+class BatchQuery(BaseModel):
+    queries: list[str]
+    n_results: int = N_RESULTS
+    generate: bool = False
+    subject: bool = False
+    include_text: bool = False
+
+def relevance_score(distance):
+    return round(max(0, (2 - distance) / 2 * 100))
+
+def result_metadata(results):
+    # Source and relevance score of the best hit
+    distance = results["distances"][0]
+    metadatas = results["metadatas"][0]
+    if not distance or not metadatas:
+        return {"source": None, "relevance": 0}
+
+    metadatas_topics = metadatas[0]
+
+    return {
+        "source": metadatas_topics['source'],
+        "relevance": relevance_score(distance[0]),
+    }
+
+def compact_result(query, hit, answer=None, include_text=False):
+    # Une ligne par hit: id du chunk, source, categorie et pertinence
+    item = {"query": query, "hits": []}
+    if hit is not None:
+        passages, results = hit
+        item["index_version"] = results.get("index_version")
+        for chunk_id, metadata, distance, passage in zip(
+            results["ids"][0], results["metadatas"][0], results["distances"][0], passages
+        ):
+            entry = {
+                "id": chunk_id,
+                "source": metadata.get("source"),
+                "categorie": metadata.get("categorie"),
+                "relevance": relevance_score(distance),
+            }
+            if include_text:
+                entry["text"] = "\n".join(text for _, text in passage)
+            item["hits"].append(entry)
+    if answer is not None:
+        item["answer"] = answer
+    return item
+
+def build_result(query, answer, results):
+    metadata = result_metadata(results)
+    return {
+        "id": 1,
+        "title": f"Résultat pour '{query}'",
+        "excerpt": answer,
+        "source": metadata["source"],
+        "date": date.today().isoformat(),
+        "type": "Réponse IA",
+        "relevance": metadata["relevance"],
+        "link": "#"  
+    }
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.post("/search")
-def search(data: Query):
+async def search(data: Query):
     # Search endpoint that returns AI-generated answers based on document retrieval
-    print("Requete recue : ", data.query)
-    model_response, results = model.prompt_augmentation(data.query)
+    start = time.perf_counter()
+    model_response, results = await model.aprompt_augmentation(data.query)
     
-    distance = results["distances"][0]
-    relevance = max(0, (2 - distance[0]) / 2 * 100)
+    payload = {
+        "results": [build_result(data.query, model_response, results)]
+    }
     
-    metadatas = results["metadatas"][0]
-    metadatas_topics = metadatas[0]
+    duration = time.perf_counter() - start
+    REQUEST_LATENCY.labels("search").observe(duration)
+    result = payload["results"][0]
+    log_sampled(
+        "search",
+        query=data.query,
+        source=result["source"],
+        relevance=result["relevance"],
+        answer_chars=len(model_response),
+        duration_ms=round(duration * 1000, 1),
+    )
     
+    return payload
+
+@app.post("/search/batch")
+async def search_batch(data: BatchQuery):
+    """Bulk retrieval for evaluation runs: one encode and one vector query for the whole batch"""
+    if len(data.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"Au plus {BATCH_MAX_QUERIES} questions par lot.")
+    if data.n_results < 1:
+        raise HTTPException(status_code=422, detail="n_results doit etre positif.")
+
+    if data.generate:
+        # File pleine: 503 avant de lancer la recherche
+        model.resized_admission().check()
+
+    start = time.perf_counter()
+    hits, answers = await model.abatch_search(
+        data.queries, data.n_results, generate=data.generate, use_subject=data.subject
+    )
     payload = {
         "results": [
-            {
-                "id": 1,
-                "title": f"Résultat pour '{data.query}'",
-                "excerpt": model_response,
-                "source": metadatas_topics['source'],
-                "date": date.today().isoformat(),
-                "type": "Réponse IA",
-                "relevance": round(relevance),
-                "link": "#"  
-            }
+            compact_result(query, hit, answer, data.include_text)
+            for query, hit, answer in zip(data.queries, hits, answers)
         ]
     }
-    
-    print("Réponse envoyée au front :", payload)
-    
+
+    duration = time.perf_counter() - start
+    REQUEST_LATENCY.labels("search_batch").observe(duration)
+    log_sampled(
+        "search_batch",
+        queries=len(data.queries),
+        generate=data.generate,
+        duration_ms=round(duration * 1000, 1),
+    )
     return payload
 
+@app.post("/search/stream")
+async def search_stream(data: Query):
+    """Server-sent events: retrieval metadata first, then the answer tokens as they are generated"""
+    start = time.perf_counter()
+    deadline = request_deadline()
+    embedding, cached = await model.alookup(data.query)
+    if cached is not None:
+        prompt, results = None, cached["results"]
+    else:
+        # File pleine: 503 avant d'ouvrir le flux
+        model.resized_admission().check()
+        prompt, results = await model.aretrieve(data.query, deadline)
+
+    async def events():
+        result = build_result(data.query, "", results)
+        del result["excerpt"]
+        yield sse_event("metadata", result)
+
+        if cached is not None:
+            yield sse_event("token", {"token": cached["answer"]})
+            yield sse_event("done", {"cached": True})
+            REQUEST_LATENCY.labels("search_stream").observe(time.perf_counter() - start)
+            return
+
+        tokens = []
+        try:
+            async for token in model.astream_answer(prompt, deadline):
+                tokens.append(token)
+                yield sse_event("token", {"token": token})
+            model.remember(embedding, "".join(tokens).strip(), results)
+        except Overloaded as e:
+            yield sse_event("error", {"message": "Service surchargé, veuillez réessayer.", "retry_after": e.retry_after})
+        except Exception:
+            yield sse_event("error", {"message": "Génération interrompue."})
+        yield sse_event("done", {"cached": False})
+
+        duration = time.perf_counter() - start
+        REQUEST_LATENCY.labels("search_stream").observe(duration)
+        log_sampled(
+            "search_stream",
+            query=data.query,
+            source=result["source"],
+            relevance=result["relevance"],
+            tokens=len(tokens),
+            duration_ms=round(duration * 1000, 1),
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: per-stage latency histograms, Ollama tokens, cache stats"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Semantic answer cache counters"""
+    return model.cache.stats()
+
+@app.post("/admin/reload")
+def trigger_reload():
+    """Admin endpoint to swap in the latest index without restarting (called by pipeline after updates)"""
+    if not model.pipeline.indexes.start_reload():
+        return {"status": "already_reloading"}
+    return {"status": "reloading"}
+
+@app.get("/admin/index")
+def index_status():
+    """Active index version and reload state"""
+    return model.pipeline.indexes.status()
+
+@app.get("/admin/ollama")
+def ollama_status():
+    """Per-instance state of the Ollama pool: load, health, circuit and latency"""
+    return model.pool.stats()
+
 @app.post("/admin/restart")
 def trigger_restart():
     """Admin endpoint to restart the API container (called by pipeline after updates)"""
@@ -0,0 +1,141 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+# Similarite cosinus minimale pour considerer deux questions comme equivalentes
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.95"))
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "86400"))
+# Versions d'index remplacees dont on ignore encore les requetes en retard
+RETIRED_VERSIONS = 16
+
+class SemanticCache:
+    """Answer cache matched on query embedding similarity, with LRU/TTL eviction and index versioning"""
+
+    def __init__(self, threshold=CACHE_SIMILARITY_THRESHOLD, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL_SECONDS):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = None
+        self._retired = deque(maxlen=RETIRED_VERSIONS)
+
+        # Une ligne de la matrice par emplacement, l'OrderedDict garde l'ordre LRU des emplacements
+        self._vectors = None
+        self._used = np.zeros(max_size, dtype=bool)
+        self._created = np.zeros(max_size, dtype=np.float64)
+        self._entries = OrderedDict()
+        self._free = list(range(max_size - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self, version):
+        """False for a request still running on a replaced index (its lookups and answers are ignored)"""
+        if version == self.version:
+            return True
+        if version in self._retired:
+            return False
+        # Un nouvel index (reindexation nocturne) rend toutes les reponses obsoletes
+        if self._entries:
+            self.invalidations += 1
+        self._clear()
+        if self.version is not None:
+            self._retired.append(self.version)
+        self.version = version
+        return True
+
+    def _clear(self):
+        self._entries.clear()
+        self._used[:] = False
+        self._free = list(range(self.max_size - 1, -1, -1))
+
+    def _remove(self, slot):
+        self._entries.pop(slot, None)
+        self._used[slot] = False
+        self._free.append(slot)
+
+    def get(self, embedding, version):
+        """Returns the cached entry closest to the query, or None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            if not self._check_version(version) or not self._entries:
+                self.misses += 1
+                return None
+
+            slots = np.flatnonzero(self._used)
+            # Les entrees expirees sont evincees pendant le parcours, pas seulement la meilleure
+            expired = time.monotonic() - self._created[slots] > self.ttl
+            if expired.any():
+                for slot in slots[expired]:
+                    self._remove(int(slot))
+                self.evictions += int(expired.sum())
+                slots = slots[~expired]
+                if len(slots) == 0:
+                    self.misses += 1
+                    return None
+
+            similarities = self._vectors[slots] @ query
+            best = int(np.argmax(similarities))
+            slot = int(slots[best])
+            entry = self._entries[slot]
+
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return entry
+
+    def put(self, embedding, version, chunk_ids, answer, results):
+        """Stores a generated answer with the retrieved chunk ids"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if not self._check_version(version):
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+
+            if not self._free:
+                oldest, _ = self._entries.popitem(last=False)
+                self._used[oldest] = False
+                self._free.append(oldest)
+                self.evictions += 1
+
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._used[slot] = True
+            self._created[slot] = time.monotonic()
+            self._entries[slot] = {
+                "chunk_ids": list(chunk_ids),
+                "answer": answer,
+                "results": results,
+                "created": time.monotonic(),
+            }
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": CACHE_ENABLED,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "index_version": self.version,
+            }
@@ -0,0 +1,107 @@
+import os
+from corpus import parse_chunk_id
+
+# Budget de tokens pour les documents injectes dans le prompt de generation
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Estimation sans tokenizer Mistral: environ 3.5 caracteres par token pour du francais
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))
+# Le batch decoupe avec 50 caracteres de chevauchement, on cherche un peu plus large
+MAX_OVERLAP = int(os.getenv("CONTEXT_MAX_OVERLAP", "120"))
+MIN_OVERLAP = 10
+# En dessous de ce reste de budget, on ne tronque pas un passage: on s'arrete
+MIN_TRUNCATED_TOKENS = 40
+
+def estimate_tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN) + 1 if text else 0
+
+def overlap_length(left, right, max_overlap=MAX_OVERLAP):
+    """Length of the longest suffix of left that is also a prefix of right"""
+    for k in range(min(max_overlap, len(left), len(right)), MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:k]):
+            return k
+    return 0
+
+def adjacent(left_id, right_id):
+    left, right = parse_chunk_id(left_id), parse_chunk_id(right_id)
+    return left is not None and right is not None and left[0] == right[0] and right[1] == left[1] + 1
+
+def truncate(text, max_chars):
+    """Cuts at the last sentence end (or word) before max_chars"""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    for sep in (". ", " "):
+        position = cut.rfind(sep)
+        if position > max_chars // 2:
+            return cut[:position + 1].rstrip()
+    return cut
+
+class ContextBuilder:
+    """Packs retrieved passages into the prompt: overlap removed, duplicates skipped, token budget enforced"""
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    def merge(self, chunks):
+        """Joins consecutive chunks of a passage without repeating their overlap"""
+        text = ""
+        previous_id = None
+        removed = 0
+        for chunk_id, chunk in chunks:
+            if not text:
+                text = chunk
+            elif adjacent(previous_id, chunk_id):
+                k = overlap_length(text, chunk)
+                removed += k
+                text += chunk[k:]
+            else:
+                text += " [...] " + chunk
+            previous_id = chunk_id
+        return text, removed
+
+    def build(self, passages):
+        """Returns (context text, stats) for passages given in rank order"""
+        seen = set()
+        blocks = []
+        stats = {
+            "passages": len(passages),
+            "chunks": 0,
+            "duplicates_removed": 0,
+            "overlap_chars_removed": 0,
+            "raw_tokens": 0,
+            "context_tokens": 0,
+            "truncated": False,
+        }
+        remaining = self.token_budget
+
+        for passage in passages:
+            stats["raw_tokens"] += sum(estimate_tokens(text) for _, text in passage)
+            chunks = []
+            for chunk_id, text in passage:
+                if chunk_id in seen:
+                    stats["duplicates_removed"] += 1
+                    continue
+                chunks.append((chunk_id, text))
+            if not chunks or remaining <= 0:
+                continue
+
+            block, removed = self.merge(chunks)
+            tokens = estimate_tokens(block)
+            if tokens > remaining:
+                if remaining < MIN_TRUNCATED_TOKENS:
+                    stats["truncated"] = True
+                    remaining = 0
+                    continue
+                block = truncate(block, int(remaining * CHARS_PER_TOKEN))
+                tokens = estimate_tokens(block)
+                stats["truncated"] = True
+
+            seen.update(chunk_id for chunk_id, _ in chunks)
+            stats["chunks"] += len(chunks)
+            stats["overlap_chars_removed"] += removed
+            blocks.append(block)
+            remaining -= tokens
+
+        context = "\n\n".join(f"Document {i} :\n{block}" for i, block in enumerate(blocks, 1))
+        stats["context_tokens"] = estimate_tokens(context)
+        return context, stats
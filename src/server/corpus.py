@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import numpy as np
+
+# Les ids sont ecrits par le batch sous la forme "<document>_chunk_<ordinal>"
+CHUNK_ID_PATTERN = re.compile(r"^(?P<document>.*)_chunk_(?P<ordinal>\d+)$")
+CORPUS_PAGE_SIZE = int(os.getenv("CORPUS_PAGE_SIZE", "5000"))
+NEIGHBOR_WINDOW = int(os.getenv("NEIGHBOR_WINDOW", "1"))
+
+def parse_chunk_id(chunk_id):
+    """Returns (document id, ordinal) or None for ids that do not follow the batch convention"""
+    match = CHUNK_ID_PATTERN.match(chunk_id)
+    if match is None:
+        return None
+    return match.group("document"), int(match.group("ordinal"))
+
+class MappedTexts:
+    """Read-only sequence of UTF-8 texts stored in one memory-mapped blob with an offsets array"""
+
+    def __init__(self, blob_path, offsets_path):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        if os.path.getsize(blob_path) > 0:
+            self.blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self.blob = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class CorpusTable:
+    """In-memory copy of the collection texts, addressable by chunk id and by (document, ordinal)"""
+
+    def __init__(self, ids, documents, metadatas, embeddings=None):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+        self.position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        self.by_ordinal = {}
+        for i, chunk_id in enumerate(ids):
+            key = parse_chunk_id(chunk_id)
+            if key is not None:
+                self.by_ordinal[key] = i
+
+        # Categories encodees en entiers pour filtrer la recherche dense sans Chroma
+        self.category_codes = {}
+        self.categories = np.array(
+            [self.category_codes.setdefault(m.get("categorie"), len(self.category_codes)) for m in metadatas],
+            dtype=np.int32,
+        )
+        # Lignes regroupees par categorie (from_collection): partition = tranche [start, end) de la
+        # matrice, une vue sans copie du fichier mappe. Vide si une categorie est en plusieurs blocs
+        self.partitions = {}
+        if len(self.categories):
+            change = np.flatnonzero(np.diff(self.categories)) + 1
+            starts = np.concatenate(([0], change))
+            ends = np.concatenate((change, [len(self.categories)]))
+            runs = self.categories[starts]
+            if len(np.unique(runs)) == len(runs):
+                self.partitions = {int(c): (int(s), int(e)) for c, s, e in zip(runs, starts, ends)}
+        self.sq_norms = None
+        if embeddings is not None and len(embeddings):
+            self.sq_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+
+    @classmethod
+    def from_collection(cls, collection, page_size=CORPUS_PAGE_SIZE):
+        """Reads the whole collection once, page by page, with the chunks of each category stored contiguously"""
+        ids, documents, metadatas, embeddings = [], [], [], []
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            documents.extend(page["documents"])
+            metadatas.extend(page["metadatas"])
+            embeddings.append(np.asarray(page["embeddings"], dtype=np.float32))
+            offset += len(page["ids"])
+        matrix = np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        codes = {}
+        order = np.argsort([codes.setdefault(m.get("categorie"), len(codes)) for m in metadatas], kind="stable")
+        if len(order):
+            ids = [ids[i] for i in order]
+            documents = [documents[i] for i in order]
+            metadatas = [metadatas[i] for i in order]
+            matrix = matrix[order]
+        print(f"[SERVER] Table des voisins construite: {len(ids)} chunks")
+        return cls(ids, documents, metadatas, matrix)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def save(self, path):
+        """Writes the table as memory-mappable files: embeddings.npy, texts.bin + text_offsets.npy, chunks.json"""
+        os.makedirs(path, exist_ok=True)
+        offsets = np.zeros(len(self.documents) + 1, dtype=np.int64)
+        with open(os.path.join(path, "texts.bin"), "wb") as f:
+            for i, text in enumerate(self.documents):
+                data = str(text).encode("utf-8")
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+        np.save(os.path.join(path, "text_offsets.npy"), offsets)
+        embeddings = self.embeddings if self.embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(path, "embeddings.npy"), np.ascontiguousarray(embeddings, dtype=np.float32))
+        with open(os.path.join(path, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "metadatas": self.metadatas}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        """Opens a saved table: texts and embeddings stay in the page cache, shared between processes"""
+        with open(os.path.join(path, "chunks.json"), encoding="utf-8") as f:
+            chunks = json.load(f)
+        documents = MappedTexts(os.path.join(path, "texts.bin"), os.path.join(path, "text_offsets.npy"))
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        return cls(chunks["ids"], documents, chunks["metadatas"], embeddings)
+
+    def dense_search(self, query_embedding, n_results, category=None):
+        """Exact squared-L2 search over the embedding matrix, in Chroma's result shape"""
+        return self.dense_search_batch([query_embedding], n_results, category)[0]
+
+    def dense_search_batch(self, query_embeddings, n_results, category=None, block=64):
+        """dense_search for several queries, one matrix product per block of queries"""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if self.sq_norms is None:
+            return [self.as_result([], query) for query in queries]
+        matrix, sq_norms, offset = self.embeddings, self.sq_norms, 0
+        count = len(sq_norms)
+        if category is not None:
+            code = self.category_codes.get(category)
+            if code is None:
+                return [self.as_result([], query) for query in queries]
+            if code in self.partitions:
+                offset, end = self.partitions[code]
+                matrix, sq_norms = self.embeddings[offset:end], self.sq_norms[offset:end]
+                count = end - offset
+            else:
+                # Table non regroupee (snapshot exporte avant le regroupement): matrice complete,
+                # les chunks des autres categories sont ecartes par une distance infinie
+                mask = self.categories == code
+                sq_norms = np.where(mask, self.sq_norms, np.inf)
+                count = int(mask.sum())
+        k = min(n_results, count)
+        if k == 0:
+            return [self.as_result([], query) for query in queries]
+
+        results = []
+        for start in range(0, len(queries), block):
+            rows = queries[start:start + block]
+            distances = sq_norms - 2 * (rows @ matrix.T) + np.einsum("ij,ij->i", rows, rows)[:, None]
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            for query, row, best in zip(rows, distances, top):
+                best = best[np.argsort(row[best])]
+                results.append(self.as_result(best + offset, query))
+        return results
+
+    def neighbors(self, chunk_id, window=NEIGHBOR_WINDOW):
+        """Positions of the chunk and its neighbors in the same document, in reading order"""
+        key = parse_chunk_id(chunk_id)
+        if key is None:
+            return None
+        document, ordinal = key
+        positions = []
+        for o in range(ordinal - window, ordinal + window + 1):
+            i = self.by_ordinal.get((document, o))
+            if i is not None:
+                positions.append(i)
+        return positions or None
+
+    def distances(self, query_embedding, positions):
+        """Squared L2 distances, as returned by Chroma's default space"""
+        if self.embeddings is None or len(positions) == 0:
+            return np.zeros(len(positions), dtype=np.float32)
+        diff = self.embeddings[positions] - np.asarray(query_embedding, dtype=np.float32)
+        return np.einsum("ij,ij->i", diff, diff)
+
+    def as_result(self, positions, query_embedding):
+        """Chroma-shaped query result for hits selected outside Chroma"""
+        positions = [int(p) for p in positions]
+        return {
+            "ids": [[self.ids[p] for p in positions]],
+            "documents": [[self.documents[p] for p in positions]],
+            "metadatas": [[self.metadatas[p] for p in positions]],
+            "distances": [[float(d) for d in self.distances(query_embedding, positions)]],
+        }
+
+    def expand(self, hit_ids, window=NEIGHBOR_WINDOW):
+        """Returns one list of positions per hit, None for hits unknown to the table"""
+        return [self.neighbors(chunk_id, window) for chunk_id in hit_ids]
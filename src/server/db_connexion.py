@@ -1,7 +1,11 @@
 import chromadb 
 import os
+import json
 import tempfile
 import shutil
+import fcntl
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
 
 try:
     from azure.identity import ClientSecretCredential, DefaultAzureCredential
@@ -14,12 +18,27 @@ except ModuleNotFoundError:
         "  - conda:  conda install -c conda-forge azure-identity azure-storage-file-datalake"
     )
 
-ACCOUNT_NAME = "juridicai"
+ACCOUNT_NAME = os.getenv("AZURE_STORAGE_ACCOUNT", "juridicai").strip()
 ACCOUNT_KEY = os.getenv("AZURE_STORAGE_KEY", "").strip()
-FILESYSTEM = "data"
+FILESYSTEM = os.getenv("STORAGE_FILESYSTEM", "data").strip()
+# Dossier local utilise a la place d'ADLS (benchmarks, developpement hors Azure)
+ADLS_LOCAL_ROOT = os.getenv("ADLS_LOCAL_ROOT", "").strip()
+JSON_FILE = "base_dechets.json"
+
+# Copie locale persistante de la base Chroma (vide = pas de cache, telechargement complet)
+CHROMA_CACHE_DIR = os.getenv("CHROMA_CACHE_DIR", os.path.expanduser("~/.cache/juridicai/chromadb"))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+# Les fichiers plus gros que ce seuil sont telecharges en plusieurs plages en parallele
+DOWNLOAD_RANGE_THRESHOLD = int(os.getenv("DOWNLOAD_RANGE_THRESHOLD", str(32 * 1024 * 1024)))
+DOWNLOAD_RANGE_SIZE = int(os.getenv("DOWNLOAD_RANGE_SIZE", str(8 * 1024 * 1024)))
+MANIFEST_FILE = ".manifest.json"
+LOCK_FILE = ".lock"
 
 def get_dls_client():
     """Creates and returns an Azure Data Lake Storage client"""
+    if ADLS_LOCAL_ROOT:
+        from local_adls import LocalDataLakeServiceClient
+        return LocalDataLakeServiceClient(ADLS_LOCAL_ROOT)
     if not ACCOUNT_NAME or not FILESYSTEM:
         raise SystemExit("Veuillez définir AZURE_STORAGE_ACCOUNT et STORAGE_FILESYSTEM.")
     account_url = f"https://{ACCOUNT_NAME}.dfs.core.windows.net"
@@ -42,36 +61,209 @@ def get_dls_client():
         credential = ClientSecretCredential(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret)
         return DataLakeServiceClient(account_url=account_url, credential=credential)
 
-def download_directory(file_system_client, remote_path, local_path):
-    """Recursively downloads a directory from ADLS"""
+@contextmanager
+def exclusive_lock(path):
+    """Inter-process lock (flock) held while a worker writes a shared directory"""
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def open_download(file_client, offset=None, length=None):
+    if hasattr(file_client, "download_file"):
+        return file_client.download_file(offset=offset, length=length)
+    return file_client.read_file(offset=offset, length=length)
+
+def load_manifest(local_path):
+    try:
+        with open(os.path.join(local_path, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(local_path, manifest):
+    manifest_path = os.path.join(local_path, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def download_range(file_system_client, remote_file, part_path, offset, length):
+    """Downloads one byte range of a remote file at the same offset in the .part file"""
+    file_client = file_system_client.get_file_client(remote_file)
+    with open(part_path, "r+b") as f:
+        f.seek(offset)
+        open_download(file_client, offset=offset, length=length).readinto(f)
+
+def directory_lock(local_path):
+    """Lock of a local copy: uvicorn workers sharing CHROMA_CACHE_DIR sync it one at a time"""
+    os.makedirs(local_path, exist_ok=True)
+    return exclusive_lock(os.path.join(local_path, LOCK_FILE))
+
+def download_directory(file_system_client, remote_path, local_path, workers=DOWNLOAD_WORKERS):
+    """Syncs a directory from ADLS under the directory lock (see sync_directory)"""
+    with directory_lock(local_path):
+        sync_directory(file_system_client, remote_path, local_path, workers)
+
+def sync_directory(file_system_client, remote_path, local_path, workers=DOWNLOAD_WORKERS):
+    """Syncs a directory from ADLS: concurrent, ranged for big files, skipping files unchanged since the last sync
+
+    The caller must hold directory_lock(local_path): the .part files and the manifest are shared.
+    Raises RuntimeError if any file failed to download.
+    """
     os.makedirs(local_path, exist_ok=True)
     try:
-        paths = file_system_client.get_paths(path=remote_path)
-        for p in paths:
+        remote = {}
+        for p in file_system_client.get_paths(path=remote_path):
             if p.is_directory:
                 continue
-            
             relative_path = os.path.relpath(p.name, remote_path)
+            remote[relative_path] = {
+                "name": p.name,
+                "size": int(p.content_length or 0),
+                "etag": str(p.etag or ""),
+            }
+    except Exception as e:
+        print(f"Info: Impossible de télécharger le dossier (il n'existe peut-être pas encore): {e}")
+        return
+
+    manifest = load_manifest(local_path)
+
+    # Supprime les fichiers locaux qui n'existent plus dans ADLS
+    for relative_path in list(manifest):
+        if relative_path not in remote:
+            manifest.pop(relative_path)
+            try:
+                os.remove(os.path.join(local_path, relative_path))
+            except OSError:
+                pass
+
+    to_fetch = []
+    for relative_path, info in remote.items():
+        local_file_path = os.path.join(local_path, relative_path)
+        known = manifest.get(relative_path)
+        if (
+            known is not None
+            and known.get("etag") == info["etag"]
+            and known.get("size") == info["size"]
+            and os.path.exists(local_file_path)
+            and os.path.getsize(local_file_path) == info["size"]
+        ):
+            continue
+        to_fetch.append(relative_path)
+
+    skipped = len(remote) - len(to_fetch)
+    fetched = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = []
+        for relative_path in to_fetch:
+            info = remote[relative_path]
             local_file_path = os.path.join(local_path, relative_path)
-            
+            part_path = local_file_path + ".part"
             os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-            
-            file_client = file_system_client.get_file_client(p.name)
-            with open(local_file_path, "wb") as f:
-                if hasattr(file_client, "read_file"):
-                    download = file_client.read_file()
-                else:
-                    download = file_client.download_file()
-                download.readinto(f)
-        print(f"Dossier téléchargé depuis ADLS: {remote_path} -> {local_path}")
+
+            # Fichier pre-alloue: chaque plage s'ecrit a son offset
+            with open(part_path, "wb") as f:
+                f.truncate(info["size"])
+
+            if info["size"] > DOWNLOAD_RANGE_THRESHOLD:
+                ranges = [
+                    (offset, min(DOWNLOAD_RANGE_SIZE, info["size"] - offset))
+                    for offset in range(0, info["size"], DOWNLOAD_RANGE_SIZE)
+                ]
+            else:
+                ranges = [(None, None)]
+            futures = [
+                executor.submit(download_range, file_system_client, info["name"], part_path, offset or 0, length)
+                for offset, length in ranges
+            ]
+            pending.append((relative_path, part_path, futures))
+
+        # Chaque fichier termine est enregistre tout de suite: apres une interruption, les fichiers
+        # deja termines ne sont pas retelecharges (un fichier incomplet est repris depuis le debut)
+        for relative_path, part_path, futures in pending:
+            wait(futures)
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            if errors:
+                print(f"Erreur lors du téléchargement de {relative_path}: {errors[0]}")
+                failed.append(relative_path)
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
+                continue
+            os.replace(part_path, os.path.join(local_path, relative_path))
+            info = remote[relative_path]
+            manifest[relative_path] = {"size": info["size"], "etag": info["etag"]}
+            save_manifest(local_path, manifest)
+            fetched += 1
+
+    # Un fichier manquant laisserait un melange de deux generations de la base: l'appelant ne doit
+    # pas l'ouvrir (le rechargement garde l'index actuel), le prochain essai reprend ces fichiers
+    if failed:
+        raise RuntimeError(f"Synchronisation incomplète de {remote_path}: {len(failed)} fichier(s) en échec ({', '.join(failed[:5])})")
+    save_manifest(local_path, manifest)
+    print(f"Dossier synchronisé depuis ADLS: {remote_path} -> {local_path} ({fetched} téléchargé(s), {skipped} inchangé(s))")
+
+def copy_snapshot(cache_path, local_path):
+    """Copies the cached snapshot into a private working directory (Chroma writes to its folder)"""
+    shutil.copytree(
+        cache_path,
+        local_path,
+        dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns(MANIFEST_FILE, LOCK_FILE, "*.part", "*.tmp"),
+    )
+
+def release_chroma_client(client):
+    """Closes a PersistentClient (SQLite handle, entry in Chroma's per-path system cache) before its folder is deleted"""
+    # chromadb recent: close() libere le systeme partage (compte de references)
+    if hasattr(client, "close"):
+        try:
+            client.close()
+            return
+        except Exception as e:
+            print(f"[SERVER] Erreur lors de la fermeture du client Chroma: {e}")
+    system = getattr(client, "_system", None)
+    if system is None:
+        return
+    try:
+        system.stop()
     except Exception as e:
-        print(f"Info: Impossible de télécharger le dossier (il n'existe peut-être pas encore): {e}")
+        print(f"[SERVER] Erreur lors de l'arret du client Chroma: {e}")
+    # Versions sans close(): retirer le systeme du cache par chemin partage par tous les clients
+    for module in ("chromadb.api.shared_system_client", "chromadb.api.client"):
+        try:
+            shared = __import__(module, fromlist=["SharedSystemClient"]).SharedSystemClient
+        except (ImportError, AttributeError):
+            continue
+        for name in ("_identifier_to_system", "_identifer_to_system"):
+            systems = getattr(shared, name, None)
+            if isinstance(systems, dict):
+                for identifier, cached in list(systems.items()):
+                    if cached is system:
+                        systems.pop(identifier, None)
+        return
+
+def read_text_from_adls(file_system_client, file_path):
+    """Reads a text file from ADLS and returns its content"""
+    try:
+        file_client = file_system_client.get_file_client(file_path)
+        if hasattr(file_client, "read_file"):
+            downloader = file_client.read_file()
+        else:
+            downloader = file_client.download_file()
+        return downloader.readall().decode("utf-8")
+    except Exception as e:
+        print(f"Erreur lors de la lecture: {e}")
+        return None
 
 class RetrievalPipeline:
     """Simplified version for API server - READ ONLY. No embedding, no indexing, just ChromaDB connection"""
     
-    def __init__(self):
-        self.dls_client = get_dls_client()
+    def __init__(self, dls_client=None):
+        self.dls_client = dls_client or get_dls_client()
         self.file_system = self.dls_client.get_file_system_client(FILESYSTEM)
         
         self.local_db_path = tempfile.mkdtemp(prefix="chroma_db_")
@@ -79,14 +271,33 @@ class RetrievalPipeline:
         
         print(f"[SERVER] Initialisation: Dossier temporaire créé à {self.local_db_path}")
         print("[SERVER] Initialisation: Téléchargement de la base Chroma depuis ADLS...")
-        download_directory(self.file_system, self.remote_db_path, self.local_db_path)
+        try:
+            if CHROMA_CACHE_DIR:
+                # Seuls les fichiers modifies depuis le dernier demarrage sont telecharges; la copie se fait
+                # sous le meme verrou pour ne pas lire un fichier qu'un autre worker est en train de remplacer
+                with directory_lock(CHROMA_CACHE_DIR):
+                    sync_directory(self.file_system, self.remote_db_path, CHROMA_CACHE_DIR)
+                    copy_snapshot(CHROMA_CACHE_DIR, self.local_db_path)
+            else:
+                download_directory(self.file_system, self.remote_db_path, self.local_db_path)
+        except Exception:
+            shutil.rmtree(self.local_db_path, ignore_errors=True)
+            raise
         
         self.chroma_client = chromadb.PersistentClient(path=self.local_db_path)
         self.collection = self.chroma_client.get_or_create_collection(name="law_text")
-        print(f"[SERVER] Collection chargée avec {self.collection.count()} documents")
+        count = self.collection.count()
+        # Version ecrite par le batch a chaque publication, sinon derivee du contenu
+        metadata = self.collection.metadata or {}
+        self.index_version = metadata.get("index_version") or f"{self.collection.id}:{count}"
+        print(f"[SERVER] Collection chargée avec {count} documents (version {self.index_version})")
 
     def cleanup(self):
-        """Cleans up the temporary directory"""
+        """Releases the Chroma client, then cleans up the temporary directory"""
+        if self.chroma_client is not None:
+            release_chroma_client(self.chroma_client)
+            self.chroma_client = None
+            self.collection = None
         try:
             print(f"[SERVER] Nettoyage: Suppression du dossier temporaire {self.local_db_path}")
             shutil.rmtree(self.local_db_path)
@@ -0,0 +1,80 @@
+import os
+import sys
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+# Backends d'embedding, tous compatibles avec les vecteurs deja indexes (meme modele, meme dimension):
+# - "torch":      PyTorch fp32 (reference)
+# - "torch-int8": PyTorch, couches lineaires quantifiees dynamiquement en int8
+# - "onnx":       ONNX Runtime fp32
+# - "onnx-int8":  ONNX Runtime, modele quantifie int8 publie avec all-MiniLM-L6-v2
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").strip().lower()
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+BACKENDS = ["torch", "torch-int8", "onnx", "onnx-int8"]
+
+DRIFT_SAMPLES = [
+    "Quelles sont les obligations de tri des déchets pour une entreprise ?",
+    "collecte des déchets dangereux par un collecteur agréé",
+    "Les huiles usagées doivent être remises à un collecteur enregistré.",
+    "article 3 de l'arrêté relatif à la gestion des déchets",
+    "tri du papier, du carton et des PMC dans les bureaux",
+    "Le producteur de déchets conserve les preuves de collecte pendant cinq ans.",
+]
+
+def load_embedding_model(backend=None, threads=None):
+    """Returns a SentenceTransformer-compatible encoder for the configured backend (threads: torch threads, default EMBEDDING_THREADS)"""
+    backend = (backend or EMBEDDING_BACKEND).strip().lower()
+    if backend not in BACKENDS:
+        raise SystemExit(f"EMBEDDING_BACKEND inconnu: {backend} (attendu: {', '.join(BACKENDS)})")
+
+    threads = EMBEDDING_THREADS if threads is None else threads
+    if threads > 0:
+        import torch
+        torch.set_num_threads(threads)
+
+    if backend == "torch":
+        return SentenceTransformer(EMBEDDING_MODEL)
+
+    if backend == "torch-int8":
+        import torch
+        model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    model_kwargs = {"file_name": EMBEDDING_ONNX_FILE} if backend == "onnx-int8" else None
+    try:
+        return SentenceTransformer(EMBEDDING_MODEL, backend="onnx", model_kwargs=model_kwargs)
+    except (TypeError, ImportError, ModuleNotFoundError) as e:
+        raise SystemExit(
+            f"Backend ONNX indisponible ({e}).\n"
+            "Installez: python -m pip install 'sentence-transformers[onnx]>=3.2'"
+        )
+
+def check_drift(backend, texts=None):
+    """Cosine similarity between the backend vectors and the torch fp32 reference"""
+    texts = texts or DRIFT_SAMPLES
+    reference = load_embedding_model("torch").encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    candidate = load_embedding_model(backend).encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    cosine = np.sum(reference * candidate, axis=1)
+    return {
+        "backend": backend,
+        "samples": len(texts),
+        "mean_cosine": float(np.mean(cosine)),
+        "min_cosine": float(np.min(cosine)),
+        "p05_cosine": float(np.percentile(cosine, 5)),
+    }
+
+if __name__ == "__main__":
+    # Usage: python embeddings.py [backend] [fichier_de_textes]
+    backend = sys.argv[1] if len(sys.argv) > 1 else EMBEDDING_BACKEND
+    texts = None
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    report = check_drift(backend, texts)
+    print(f"Backend {report['backend']} sur {report['samples']} textes:")
+    print(f"  cosinus moyen vs torch fp32 : {report['mean_cosine']:.5f}")
+    print(f"  cosinus minimum             : {report['min_cosine']:.5f}")
+    print(f"  cosinus p05                 : {report['p05_cosine']:.5f}")
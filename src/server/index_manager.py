@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from db_connexion import RetrievalPipeline, get_dls_client, FILESYSTEM
+from corpus import CorpusTable
+from lexical import BM25Index
+from shared_index import SHARED_INDEX_DIR, SHARED_INDEX_POLL, load_shared_snapshot, current_snapshot_key
+
+# Delai maximal (secondes) pour laisser finir les requetes sur l'ancien index
+INDEX_DRAIN_TIMEOUT = float(os.getenv("INDEX_DRAIN_TIMEOUT", "120"))
+
+class IndexSnapshot:
+    """One loaded generation of the index: Chroma collection, corpus table and in-flight counter"""
+
+    def __init__(self, version, corpus, lexical, retrieval=None, key=None):
+        self.retrieval = retrieval
+        # Cle du snapshot partage (mode SHARED_INDEX_DIR)
+        self.key = key
+        # Sans collection (mode partage), la recherche dense se fait sur la matrice d'embeddings mappee
+        self.collection = retrieval.collection if retrieval is not None else None
+        self.version = version
+        self.corpus = corpus
+        self.lexical = lexical
+        self._inflight = 0
+        self._drained = threading.Condition()
+
+    @classmethod
+    def load(cls, dls_client):
+        if SHARED_INDEX_DIR:
+            return cls.load_shared(dls_client)
+        retrieval = RetrievalPipeline(dls_client=dls_client)
+        corpus = CorpusTable.from_collection(retrieval.collection)
+        # Index lexical construit une fois par version d'index
+        lexical = BM25Index(corpus.documents)
+        print(f"[SERVER] Index BM25 construit: {len(lexical.vocabulary)} termes")
+        return cls(retrieval.index_version, corpus, lexical, retrieval)
+
+    @classmethod
+    def load_shared(cls, dls_client):
+        meta, corpus, lexical, path = load_shared_snapshot(dls_client.get_file_system_client(FILESYSTEM))
+        print(f"[SERVER] Snapshot partagé chargé (mmap): {path}, version {meta['version']}")
+        return cls(meta["version"], corpus, lexical, key=meta["key"])
+
+    def acquire(self):
+        with self._drained:
+            self._inflight += 1
+
+    def release(self):
+        with self._drained:
+            self._inflight -= 1
+            if self._inflight == 0:
+                self._drained.notify_all()
+
+    def wait_drained(self, timeout=INDEX_DRAIN_TIMEOUT):
+        """Blocks until no request uses this snapshot anymore, returns False on timeout"""
+        with self._drained:
+            return self._drained.wait_for(lambda: self._inflight == 0, timeout=timeout)
+
+    def close(self):
+        # Les snapshots partages sont nettoyes par le worker qui publie le suivant
+        if self.retrieval is not None:
+            self.retrieval.cleanup()
+
+class IndexManager:
+    """Holds the active snapshot and swaps in a freshly downloaded one without restarting the process"""
+
+    def __init__(self):
+        self.dls_client = get_dls_client()
+        self.file_system = self.dls_client.get_file_system_client(FILESYSTEM)
+        self.current = IndexSnapshot.load(self.dls_client)
+        self._lock = threading.Lock()
+        self.reloading = False
+        self.last_error = None
+        if SHARED_INDEX_DIR and SHARED_INDEX_POLL > 0:
+            # /admin/reload n'atteint qu'un worker: les autres suivent le snapshot publie
+            threading.Thread(target=self._watch_shared, name="index-watch", daemon=True).start()
+
+    @contextmanager
+    def acquire(self):
+        """Pins the active snapshot for the duration of a request"""
+        with self._lock:
+            snapshot = self.current
+            snapshot.acquire()
+        try:
+            yield snapshot
+        finally:
+            snapshot.release()
+
+    def start_reload(self):
+        """Starts a background reload, returns False if one is already running"""
+        with self._lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+        threading.Thread(target=self._reload, name="index-reload", daemon=True).start()
+        return True
+
+    def _watch_shared(self):
+        while True:
+            time.sleep(SHARED_INDEX_POLL)
+            key = current_snapshot_key()
+            if key is not None and key != self.current.key and not self.reloading:
+                print(f"[SERVER] Nouveau snapshot partagé détecté ({key}), rechargement")
+                self.start_reload()
+
+    def _reload(self):
+        try:
+            print("[SERVER] Rechargement: construction du nouvel index en arriere-plan...")
+            snapshot = IndexSnapshot.load(self.dls_client)
+            with self._lock:
+                old, self.current = self.current, snapshot
+            print(f"[SERVER] Rechargement: index {snapshot.version} actif, attente des requetes en cours sur {old.version}")
+            if not old.wait_drained():
+                print("[SERVER] Rechargement: delai de vidange depasse, nettoyage de l'ancien index quand meme")
+            old.close()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[SERVER] Erreur lors du rechargement de l'index: {e}")
+        finally:
+            with self._lock:
+                self.reloading = False
+
+    def status(self):
+        return {
+            "version": self.current.version,
+            "documents": len(self.current.corpus),
+            "reloading": self.reloading,
+            "last_error": self.last_error,
+        }
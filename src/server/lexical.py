@@ -0,0 +1,99 @@
+import os
+import re
+import json
+import numpy as np
+from subject import STOPWORDS, strip_accents
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+BM25_ARRAYS = ["postings_docs", "postings_tf", "offsets", "idf", "length_norm"]
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+LEXICAL_STOPWORDS = {strip_accents(word) for word in STOPWORDS}
+
+def tokenize(text):
+    """Lowercased, accent-free word tokens; numbers are kept (article numbers, dates)"""
+    words = TOKEN_PATTERN.findall(strip_accents(text.lower()))
+    return [w for w in words if w not in LEXICAL_STOPWORDS and (len(w) > 1 or w.isdigit())]
+
+class BM25Index:
+    """BM25 inverted index with array-backed postings (CSR layout: one offsets array, one docs/tf pair)"""
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+
+        terms, docs, tfs = [], [], []
+        doc_len = np.zeros(len(documents), dtype=np.float32)
+        for d, text in enumerate(documents):
+            tokens = tokenize(str(text))
+            doc_len[d] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                terms.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+                docs.append(d)
+                tfs.append(tf)
+
+        terms = np.asarray(terms, dtype=np.int32)
+        order = np.argsort(terms, kind="stable")
+        self.postings_docs = np.asarray(docs, dtype=np.int32)[order]
+        self.postings_tf = np.minimum(np.asarray(tfs, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)[order]
+
+        df = np.bincount(terms, minlength=len(self.vocabulary))
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(df, out=self.offsets[1:])
+
+        n = len(documents)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_len.mean()) if n else 1.0
+        # Normalisation de longueur precalculee: k1 * (1 - b + b * |d| / avgdl)
+        self.length_norm = (k1 * (1 - b + b * doc_len / max(avgdl, 1e-6))).astype(np.float32)
+        self.size = n
+
+    def save(self, path):
+        """Writes the postings as .npy arrays and the vocabulary as JSON"""
+        os.makedirs(path, exist_ok=True)
+        for name in BM25_ARRAYS:
+            np.save(os.path.join(path, f"bm25_{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "bm25.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "size": self.size, "vocabulary": self.vocabulary}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        """Opens a saved index with memory-mapped postings"""
+        index = cls.__new__(cls)
+        with open(os.path.join(path, "bm25.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        index.k1, index.b, index.size = meta["k1"], meta["b"], meta["size"]
+        index.vocabulary = meta["vocabulary"]
+        for name in BM25_ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, f"bm25_{name}.npy"), mmap_mode="r"))
+        return index
+
+    def scores(self, query):
+        """BM25 score of every document for the query"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            scores[docs] += self.idf[term] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+        return scores
+
+    def search(self, query, k):
+        """Returns (positions, scores) of the k best documents with a positive score"""
+        scores = self.scores(query)
+        k = min(k, self.size)
+        if k <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[scores[top] > 0]
+        return top, scores[top]
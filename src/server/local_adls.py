@@ -0,0 +1,95 @@
+import os
+import hashlib
+import shutil
+from datetime import datetime, timezone
+
+class LocalPathProperties:
+    """Subset of azure PathProperties returned by get_paths"""
+
+    def __init__(self, name, full_path):
+        stat = os.stat(full_path)
+        self.name = name
+        self.is_directory = os.path.isdir(full_path)
+        self.content_length = 0 if self.is_directory else stat.st_size
+        self.last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        self.etag = hashlib.md5(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+class LocalDownloader:
+    def __init__(self, path, offset=None, length=None):
+        self.path = path
+        self.offset = offset or 0
+        self.length = length
+
+    def readall(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            return f.read() if self.length is None else f.read(self.length)
+
+    def readinto(self, stream):
+        data = self.readall()
+        stream.write(data)
+        return len(data)
+
+class LocalFileClient:
+    def __init__(self, root, path):
+        self.path = os.path.join(root, path)
+
+    def download_file(self, offset=None, length=None):
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(self.path)
+        return LocalDownloader(self.path, offset, length)
+
+    def create_file(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        open(self.path, "wb").close()
+
+    def append_data(self, data, offset, length=None):
+        with open(self.path, "r+b") as f:
+            f.seek(offset)
+            f.write(data if length is None else data[:length])
+
+    def flush_data(self, offset):
+        with open(self.path, "r+b") as f:
+            f.truncate(offset)
+
+    def delete_file(self):
+        os.remove(self.path)
+
+    def get_file_properties(self):
+        return LocalPathProperties(self.path, self.path)
+
+class LocalFileSystemClient:
+    """Filesystem-backed stand-in for DataLakeFileSystemClient (benchmarks and local development)"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def get_paths(self, path=None):
+        base = os.path.join(self.root, path) if path else self.root
+        if not os.path.isdir(base):
+            raise FileNotFoundError(base)
+        for current, dirs, files in os.walk(base):
+            dirs.sort()
+            for name in dirs + sorted(files):
+                full_path = os.path.join(current, name)
+                relative = os.path.relpath(full_path, self.root).replace(os.sep, "/")
+                yield LocalPathProperties(relative, full_path)
+
+    def get_file_client(self, path):
+        return LocalFileClient(self.root, path)
+
+    def create_directory(self, path):
+        os.makedirs(os.path.join(self.root, path), exist_ok=True)
+
+    def delete_directory(self, path):
+        shutil.rmtree(os.path.join(self.root, path))
+
+class LocalDataLakeServiceClient:
+    """Maps each ADLS file system to a sub-directory of a local root"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_file_system_client(self, file_system):
+        return LocalFileSystemClient(os.path.join(self.root, file_system))
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import random
+import logging
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+# Proportion des requetes journalisees (0 = aucune, 1 = toutes)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+STAGE_LATENCY = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of each stage of the search pipeline",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_LATENCY = Histogram(
+    "rag_request_duration_seconds",
+    "End-to-end duration of API requests",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+OLLAMA_TOKENS = Counter(
+    "ollama_tokens_total",
+    "Tokens reported by Ollama",
+    ["call", "kind"],
+)
+
+PROMPT_TOKENS = Histogram(
+    "rag_prompt_tokens",
+    "Estimated tokens of the generation prompt",
+    buckets=(128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192),
+)
+CONTEXT_TOKENS = Counter(
+    "rag_context_tokens_total",
+    "Estimated context tokens before (raw) and after (packed) context packing",
+    ["kind"],
+)
+ADMISSION_WAIT = Histogram(
+    "rag_generation_queue_wait_seconds",
+    "Time spent waiting for a generation slot",
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTIONS = Counter(
+    "rag_generation_rejections_total",
+    "Generations rejected by admission control",
+    ["reason"],
+)
+OLLAMA_BACKEND_LATENCY = Histogram(
+    "ollama_backend_duration_seconds",
+    "Duration of Ollama calls per instance",
+    ["host", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+ROUTING_DECISIONS = Counter(
+    "rag_category_routing_total",
+    "Category routing outcome per query",
+    ["outcome"],
+)
+
+logger = logging.getLogger("juridicai")
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+@contextmanager
+def timed(stage):
+    """Records the duration of the enclosed block in the stage histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+def record_ollama_usage(call, response_json):
+    """Counts prompt and completion tokens from an Ollama response (final chunk when streaming)"""
+    prompt_tokens = response_json.get("prompt_eval_count")
+    completion_tokens = response_json.get("eval_count")
+    if prompt_tokens:
+        OLLAMA_TOKENS.labels(call, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        OLLAMA_TOKENS.labels(call, "completion").inc(completion_tokens)
+
+def log_sampled(event, **fields):
+    """Structured JSON log line, emitted for a LOG_SAMPLE_RATE fraction of calls"""
+    if LOG_SAMPLE_RATE <= 0 or random.random() >= LOG_SAMPLE_RATE:
+        return
+    logger.info(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, ensure_ascii=False, default=str))
+
+class StatsCollector:
+    """Exposes the numeric values of a stats() dict as Prometheus gauges, dict values as one labelled gauge"""
+
+    def __init__(self, prefix, stats, label="key"):
+        self.prefix = prefix
+        self.stats = stats
+        self.label = label
+
+    def collect(self):
+        for key, value in self.stats().items():
+            if isinstance(value, dict):
+                family = GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.prefix} {key}", labels=[self.label])
+                for label, item in value.items():
+                    family.add_metric([str(label)], item)
+                yield family
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            yield GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.prefix} {key}", value=value)
+
+def register_stats(prefix, stats, label="key"):
+    REGISTRY.register(StatsCollector(prefix, stats, label))
@@ -1,41 +1,286 @@
-from sentence_transformers import SentenceTransformer
-from db_connexion import RetrievalPipeline
+import os
+import asyncio
+import numpy as np
+from embeddings import load_embedding_model
+from index_manager import IndexManager
+from batcher import EmbeddingBatcher, EMBED_BATCH_MAX_SIZE
+from metrics import timed, ROUTING_DECISIONS
+from subject import load_vocabulary
+from routing import CategoryRouter, CATEGORY_ROUTING
+
+N_RESULTS = int(os.getenv("N_RESULTS", "3"))
+# "dense" (Chroma seul), "hybrid" (fusion RRF dense + BM25), "lexical" (BM25 seul),
+# "auto" (BM25 seul quand il est confiant, sinon hybride)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense").strip().lower()
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Nombre de candidats par liste avant fusion = n_results * FUSION_DEPTH
+FUSION_DEPTH = int(os.getenv("FUSION_DEPTH", "4"))
+# Confiance BM25: score du premier >= ratio * score du suivant, et score minimal
+LEXICAL_CONFIDENCE_RATIO = float(os.getenv("LEXICAL_CONFIDENCE_RATIO", "1.5"))
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "5.0"))
+# Taille des lots d'encodage pour les recherches groupees (/search/batch)
+BATCH_ENCODE_SIZE = int(os.getenv("BATCH_ENCODE_SIZE", "64"))
 
 class QuerySearch:
     """Handles semantic search queries against ChromaDB"""
     
-    def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.collection = RetrievalPipeline().collection
-        
-    def query_search_db(self, query):
-        """Search for relevant documents and return neighboring chunks"""
+    def __init__(self, retrieval_mode=RETRIEVAL_MODE):
+        self.model = load_embedding_model()
+        self.retrieval_mode = retrieval_mode
+        # Collection Chroma + textes des chunks en memoire, remplacables a chaud
+        self.indexes = IndexManager()
+        self.vocabulary = load_vocabulary(self.file_system)
+        self.router = CategoryRouter(self.vocabulary)
+        # Regroupe les encodages des requetes concurrentes en un seul appel au modele
+        self.batcher = EmbeddingBatcher(self.model) if EMBED_BATCH_MAX_SIZE > 1 else None
+
+    @property
+    def index_version(self):
+        return self.indexes.current.version
+
+    @property
+    def file_system(self):
+        return self.indexes.file_system
+
+    def encode(self, text):
+        return self.model.encode(text)
+
+    async def aencode(self, text):
+        if self.batcher is not None:
+            return await self.batcher.encode(text)
+        return await asyncio.to_thread(self.encode, text)
+
+    def fetch_neighbors(self, collection, metadatas):
+        """Fallback for hits missing from the table: one batched Chroma lookup on chunk_id"""
+        wanted = set()
+        for metadata in metadatas:
+            idx = metadata["chunk_id"]
+            wanted.update([idx - 1, idx, idx + 1])
+        neighbors = collection.get(where={"chunk_id": {"$in": sorted(wanted)}})
+        by_chunk_id = {
+            metadata["chunk_id"]: (chunk_id, doc)
+            for chunk_id, doc, metadata in zip(neighbors["ids"], neighbors["documents"], neighbors["metadatas"])
+        }
+        return [
+            [by_chunk_id[i] for i in (m["chunk_id"] - 1, m["chunk_id"], m["chunk_id"] + 1) if i in by_chunk_id]
+            for m in metadatas
+        ]
+
+    def route(self, question):
+        """Category of the question (metadata 'categorie'), None to search the whole collection"""
+        if not CATEGORY_ROUTING:
+            return None
+        return self.router.route(question)
+
+    def query_search_db(self, query, n_results=N_RESULTS, category=None, lexical_query=None):
+        """Search for relevant documents and return neighboring chunks
+
+        lexical_query: text given to BM25 (the user's question, with its exact wording and article
+        numbers) when the dense side searches a rewritten subject; defaults to query
+        """
         if not query or query.strip() == "":
             return None
         
-        query_embedding = self.model.encode(query)
-        n_result = 3
-        result = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_result
-        )
-        
-        final_result = []
-        metadatas_dic = result["metadatas"][0]
-        
-        for i in range(n_result):
-            metadata = metadatas_dic[i]
-            idx = metadata["chunk_id"]
-            
-            neighbors = self.collection.get(
-                where={
-                    "chunk_id": {"$in": [idx-1, idx, idx+1]}
-                }
+        with timed("embedding"):
+            query_embedding = self.model.encode(query)
+        return self.search_embedding(query_embedding, n_results, lexical_query or query, category=category)
+
+    def dense_query(self, index, query_embedding, n_results, category=None):
+        with timed("chroma_query"):
+            if index.collection is None:
+                return index.corpus.dense_search(query_embedding, n_results, category)
+            if category is None:
+                return index.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=n_results
+                )
+            return index.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                where={"categorie": category},
             )
+
+    def dense_batch(self, index, query_embeddings, n_results, category=None):
+        """One dense query for several embeddings, split back into per-query Chroma-shaped results"""
+        with timed("chroma_query"):
+            if index.collection is None:
+                return index.corpus.dense_search_batch(query_embeddings, n_results, category)
+            if category is None:
+                batch = index.collection.query(
+                    query_embeddings=list(query_embeddings),
+                    n_results=n_results
+                )
+            else:
+                batch = index.collection.query(
+                    query_embeddings=list(query_embeddings),
+                    n_results=n_results,
+                    where={"categorie": category},
+                )
+        keys = ("ids", "documents", "metadatas", "distances")
+        return [{key: [batch[key][i]] for key in keys} for i in range(len(query_embeddings))]
+
+    def lexical_confident(self, scores):
+        # Un premier resultat BM25 nettement detache du suivant (ex: numero d'article exact)
+        if len(scores) == 0 or scores[0] < LEXICAL_MIN_SCORE:
+            return False
+        return len(scores) == 1 or scores[0] >= LEXICAL_CONFIDENCE_RATIO * scores[1]
+
+    def fused_query(self, index, query_embedding, query, n_results, mode, category=None, dense=None):
+        """Dense, lexical or reciprocal-rank-fused ranking, always returned in Chroma's result shape"""
+        depth = n_results * FUSION_DEPTH
+        with timed("lexical_query"):
+            positions, scores = index.lexical.search(query, depth)
+            if category is not None:
+                keep = [i for i, p in enumerate(positions) if index.corpus.metadatas[p].get("categorie") == category]
+                positions, scores = positions[keep], scores[keep]
+
+        if mode == "lexical" or (mode == "auto" and self.lexical_confident(scores)):
+            if len(positions):
+                return index.corpus.as_result(positions[:n_results], query_embedding)
+
+        if dense is None:
+            dense = self.dense_query(index, query_embedding, depth, category)
+        fused = {}
+        for rank, chunk_id in enumerate(dense["ids"][0]):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        for rank, p in enumerate(positions):
+            chunk_id = index.corpus.ids[p]
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+
+        best = sorted(fused, key=fused.get, reverse=True)[:n_results]
+        best_positions = [index.corpus.position[c] for c in best if c in index.corpus.position]
+        if len(best_positions) < len(best):
+            # Table en retard sur la collection: on garde le classement dense
+            return self.dense_query(index, query_embedding, n_results, category)
+        return index.corpus.as_result(np.asarray(best_positions), query_embedding)
+
+    def rank(self, index, query_embedding, n_results, query, mode, category, dense=None):
+        # dense: resultat dense deja calcule (recherche groupee), a la profondeur attendue par le mode
+        if mode == "dense" or not query:
+            if dense is not None:
+                return dense
+            return self.dense_query(index, query_embedding, n_results, category)
+        return self.fused_query(index, query_embedding, query, n_results, mode, category, dense)
+
+    def depth(self, n_results, mode):
+        return n_results if mode == "dense" else n_results * FUSION_DEPTH
+
+    def search_embedding(self, query_embedding, n_results=N_RESULTS, query=None, mode=None, category=None):
+        """Retrieval + neighbor expansion for an already encoded query, restricted to a category when given"""
+        mode = mode or self.retrieval_mode
+        with self.indexes.acquire() as index:
+            result = None
+            if category is not None:
+                result = self.rank(index, query_embedding, n_results, query, mode, category)
+                if len(result["ids"][0]) < n_results:
+                    # Partition trop petite pour cette question: recherche globale
+                    ROUTING_DECISIONS.labels("fallback").inc()
+                    result = None
+                else:
+                    ROUTING_DECISIONS.labels("routed").inc()
+            else:
+                ROUTING_DECISIONS.labels("global").inc()
+            if result is None:
+                result = self.rank(index, query_embedding, n_results, query, mode, None)
+            result["index_version"] = index.version
+        
+            with timed("neighbors"):
+                final_result = self.expand_hits(index, result)
             
-            doc_str = ""
-            for doc in neighbors["documents"]:
-                doc_str += str(doc)
-            final_result.append(doc_str)
-            
-        return final_result, result
\ No newline at end of file
+        return final_result, result
+
+    def expand_hits(self, index, result):
+        """One passage per hit: its (chunk id, text) neighbors in reading order"""
+        return self.expand_batch(index, [result])[0]
+
+    def expand_batch(self, index, results):
+        """expand_hits for several results, with a single Chroma lookup for all the hits missing from the table"""
+        passages = []
+        missing = []
+        for r, result in enumerate(results):
+            row = []
+            for i, positions in enumerate(index.corpus.expand(result["ids"][0])):
+                if positions is None:
+                    missing.append((r, i))
+                    row.append([])
+                    continue
+                row.append([(index.corpus.ids[p], str(index.corpus.documents[p])) for p in positions])
+            passages.append(row)
+
+        if missing and index.collection is None:
+            # Pas de Chroma en mode partage: le hit seul, sans voisins
+            for r, i in missing:
+                passages[r][i] = [(results[r]["ids"][0][i], str(results[r]["documents"][0][i]))]
+        elif missing:
+            metadatas = [results[r]["metadatas"][0][i] for r, i in missing]
+            fetched = self.fetch_neighbors(index.collection, metadatas)
+            for (r, i), passage in zip(missing, fetched):
+                passages[r][i] = passage
+        return passages
+
+    def batch_search_embeddings(self, query_embeddings, queries, n_results=N_RESULTS, mode=None, categories=None):
+        """search_embedding for a batch: one dense query per category, then one bulk neighbor expansion"""
+        mode = mode or self.retrieval_mode
+        categories = categories or [None] * len(queries)
+        depth = self.depth(n_results, mode)
+        results = [None] * len(queries)
+
+        groups = {}
+        for i, category in enumerate(categories):
+            groups.setdefault(category, []).append(i)
+
+        with self.indexes.acquire() as index:
+            fallback = []
+            for category, members in groups.items():
+                dense = self.dense_batch(index, query_embeddings[members], depth, category)
+                for i, dense_result in zip(members, dense):
+                    result = self.rank(index, query_embeddings[i], n_results, queries[i], mode, category, dense_result)
+                    if category is not None and len(result["ids"][0]) < n_results:
+                        # Partition trop petite pour cette question: recherche globale
+                        ROUTING_DECISIONS.labels("fallback").inc()
+                        fallback.append(i)
+                        continue
+                    ROUTING_DECISIONS.labels("global" if category is None else "routed").inc()
+                    results[i] = result
+
+            if fallback:
+                dense = self.dense_batch(index, query_embeddings[fallback], depth, None)
+                for i, dense_result in zip(fallback, dense):
+                    results[i] = self.rank(index, query_embeddings[i], n_results, queries[i], mode, None, dense_result)
+
+            for result in results:
+                result["index_version"] = index.version
+
+            with timed("neighbors"):
+                passages = self.expand_batch(index, results)
+
+        return list(zip(passages, results))
+
+    def batch_query_search_db(self, queries, n_results=N_RESULTS, mode=None, categories=None, lexical_queries=None):
+        """Retrieval for many queries at once (offline evaluation, bulk clients), None for empty queries"""
+        kept = [i for i, query in enumerate(queries) if query and query.strip()]
+        output = [None] * len(queries)
+        if not kept:
+            return output
+
+        texts = [queries[i] for i in kept]
+        if categories is None:
+            categories = [self.route(query) for query in queries]
+        with timed("embedding"):
+            embeddings = np.asarray(self.model.encode(texts, batch_size=BATCH_ENCODE_SIZE), dtype=np.float32)
+
+        lexical = [(lexical_queries[i] if lexical_queries is not None else None) or queries[i] for i in kept]
+        hits = self.batch_search_embeddings(embeddings, lexical, n_results, mode, [categories[i] for i in kept])
+        for i, hit in zip(kept, hits):
+            output[i] = hit
+        return output
+
+    async def aquery_search_db(self, query, n_results=N_RESULTS, category=None, lexical_query=None):
+        """Async retrieval step: batched encoding, then the Chroma calls run off the event loop"""
+        if not query or query.strip() == "":
+            return None
+        with timed("embedding"):
+            query_embedding = await self.aencode(query)
+        return await asyncio.to_thread(
+            self.search_embedding, query_embedding, n_results, lexical_query or query, None, category
+        )
@@ -1,19 +1,246 @@
 import requests
+import httpx
+import asyncio
+import time
 import json
 import os
-from query_search import QuerySearch
+import threading
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from query_search import QuerySearch, N_RESULTS
+from cache import SemanticCache, CACHE_ENABLED
+from subject import LocalSubjectExtractor, SUBJECT_MODE
+from metrics import timed, record_ollama_usage, STAGE_LATENCY, PROMPT_TOKENS, CONTEXT_TOKENS, OLLAMA_BACKEND_LATENCY
+from context import ContextBuilder, estimate_tokens
+from admission import AdmissionController, Overloaded, request_deadline, remaining, GENERATION_MAX_CONCURRENCY
+
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+# Timeouts (secondes) et taille du pool de connexions keep-alive vers Ollama
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "200"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "50"))
+# Instances Ollama separees par des virgules (OLLAMA_HOST reste accepte pour une seule instance)
+OLLAMA_HOSTS = [
+    host.strip().rstrip("/")
+    for host in os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://localhost:11434")).split(",")
+    if host.strip()
+]
+# Sondage /api/tags (secondes, 0 = desactive), et coupe-circuit: echecs consecutifs avant mise a l'ecart
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3"))
+OLLAMA_OPEN_SECONDS = float(os.getenv("OLLAMA_OPEN_SECONDS", "30"))
+
+SUBJECT_PREFIXES = ["Sujet :", "Sujet:", "Ligne de sujet :", "Ligne de sujet:"]
+SUBJECT_FALLBACK = "Sujet indisponible"
+GENERATION_UNAVAILABLE = "Désolé, le service de génération de réponse est indisponible pour le moment."
+
+class OllamaUnavailable(Exception):
+    """Raised when every Ollama instance is down or has its circuit open"""
+
+def backend_failure(error):
+    # Erreurs imputables a l'instance (reseau, timeout, 5xx), pas a la requete
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    if isinstance(error, requests.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, requests.ConnectionError, requests.Timeout))
+
+class OllamaBackend:
+    """One Ollama instance: in-flight requests, circuit breaker state and smoothed latency"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.url = f"{base_url}/api/generate"
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.latency = None
+
+    @property
+    def tripped(self):
+        return self.failures >= OLLAMA_FAILURE_THRESHOLD
+
+    def available(self, now):
+        if not self.healthy:
+            return False
+        if not self.tripped:
+            return True
+        # Circuit ouvert: une seule requete d'essai une fois le delai ecoule
+        return now >= self.open_until and self.outstanding == 0
+
+class OllamaPool:
+    """Least-outstanding-requests balancing over several Ollama instances, with health checks and circuit breaking"""
+
+    def __init__(self, hosts=OLLAMA_HOSTS):
+        if not hosts:
+            raise ValueError("Aucune instance Ollama configuree (OLLAMA_HOSTS)")
+        self.backends = [OllamaBackend(host) for host in hosts]
+        self.hosts = ", ".join(hosts)
+        # Compteurs partages entre la boucle d'evenements et les threads du chemin synchrone
+        self.lock = threading.Lock()
+        self._health_task = None
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b.available(now)]
+            if not candidates:
+                raise OllamaUnavailable(f"Aucune instance Ollama disponible ({self.hosts})")
+            # Moins de requetes en cours d'abord, puis la plus rapide
+            backend = min(candidates, key=lambda b: (b.outstanding, b.latency or 0.0))
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def usable(self):
+        """Number of instances that are healthy and not set aside by their circuit breaker"""
+        with self.lock:
+            now = time.monotonic()
+            return sum(b.healthy and not (b.tripped and now < b.open_until) for b in self.backends)
+
+    def release(self, backend, duration, error=None, cancelled=False):
+        failed = error is not None and backend_failure(error)
+        with self.lock:
+            backend.outstanding -= 1
+            if cancelled:
+                # Appel abandonne (client deconnecte): ni succes ni echec pour le disjoncteur
+                return
+            if error is None:
+                backend.failures = 0
+                backend.latency = duration if backend.latency is None else 0.8 * backend.latency + 0.2 * duration
+            elif failed:
+                backend.errors += 1
+                backend.failures += 1
+                if backend.tripped:
+                    if backend.failures == OLLAMA_FAILURE_THRESHOLD:
+                        print(f"[SERVER] Ollama {backend.base_url} ecarte pour {OLLAMA_OPEN_SECONDS:.0f}s apres {backend.failures} echecs")
+                    backend.open_until = time.monotonic() + OLLAMA_OPEN_SECONDS
+        OLLAMA_BACKEND_LATENCY.labels(backend.base_url, "error" if failed else "ok").observe(duration)
+
+    @contextmanager
+    def lease(self):
+        """Holds the least loaded available instance for one call"""
+        backend = self.acquire()
+        start = time.perf_counter()
+        try:
+            yield backend
+        except Exception as e:
+            self.release(backend, time.perf_counter() - start, e)
+            raise
+        except BaseException:
+            # CancelledError / GeneratorExit: ce n'est pas un succes, ne remet pas les echecs a zero
+            self.release(backend, time.perf_counter() - start, cancelled=True)
+            raise
+        self.release(backend, time.perf_counter() - start)
+
+    async def check_health(self, client):
+        async def probe(backend):
+            try:
+                r = await client.get(f"{backend.base_url}/api/tags", timeout=OLLAMA_CONNECT_TIMEOUT)
+                healthy = r.status_code == 200
+            except httpx.HTTPError:
+                healthy = False
+            if healthy != backend.healthy:
+                print(f"[SERVER] Ollama {backend.base_url} {'disponible' if healthy else 'injoignable'}")
+            backend.healthy = healthy
+
+        await asyncio.gather(*(probe(backend) for backend in self.backends))
+
+    async def _health_loop(self, client):
+        while True:
+            await self.check_health(client)
+            await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+
+    def start_health_checks(self, client):
+        """Starts the periodic /api/tags probe (must be called from the event loop)"""
+        if self._health_task is None and OLLAMA_HEALTH_INTERVAL > 0:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop(client))
+
+    async def aclose(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "backends": len(self.backends),
+            "available": sum(b.available(now) for b in self.backends),
+            "outstanding": {b.base_url: b.outstanding for b in self.backends},
+            "healthy": {b.base_url: int(b.healthy) for b in self.backends},
+            "circuit_open": {b.base_url: int(b.tripped and now < b.open_until) for b in self.backends},
+            "requests": {b.base_url: b.requests for b in self.backends},
+            "errors": {b.base_url: b.errors for b in self.backends},
+            "latency_seconds": {b.base_url: round(b.latency or 0.0, 3) for b in self.backends},
+        }
 
 class Generation:
     # Handles LLM response generation using Ollama/Mistral
     
     def __init__(self):
-        base_url = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-        self.url = f"{base_url}/api/generate"
+        self.pool = OllamaPool()
         self.pipeline = QuerySearch()
+        self.cache = SemanticCache()
+        self.context_builder = ContextBuilder()
+        # File d'attente bornee devant Ollama: au-dela, rejet immediat (503). La limite suit le nombre
+        # d'instances utilisables (voir resized_admission)
+        self.admission = AdmissionController(GENERATION_MAX_CONCURRENCY * len(self.pool.backends))
+        self.subject_mode = SUBJECT_MODE
+        self.subject_extractor = LocalSubjectExtractor(self.pipeline.model, self.pipeline.vocabulary)
 
-    def question_subject(self, query):
+        # Session keep-alive pour le chemin synchrone
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_MAX_KEEPALIVE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = (OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT)
 
-        prompt = f"""
+        # Client asynchrone cree a la premiere utilisation (dans la boucle d'evenements d'uvicorn)
+        self._async_client = None
+
+    @property
+    def async_client(self):
+        """Shared httpx client with a keep-alive connection pool to Ollama"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=OLLAMA_MAX_CONNECTIONS,
+                    max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+                ),
+            )
+        return self._async_client
+
+    def resized_admission(self):
+        """Admission controller with its limit following the instances currently usable"""
+        # Au moins une instance: un disjoncteur ouvert doit encore laisser passer sa requete d'essai
+        self.admission.resize(GENERATION_MAX_CONCURRENCY * max(1, self.pool.usable()))
+        return self.admission
+
+    def start(self):
+        """Background tasks tied to the event loop (Ollama health checks)"""
+        self.pool.start_health_checks(self.async_client)
+
+    async def aclose(self):
+        """Closes the HTTP connection pools"""
+        await self.pool.aclose()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self.pipeline.batcher is not None:
+            await self.pipeline.batcher.aclose()
+        self.session.close()
+
+    def subject_prompt(self, query):
+        return f"""
             Tu es un assistant qui génère UN SEUL sujet très concis pour une question donnée.
 
             Objectif :
@@ -47,38 +274,23 @@ class Generation:
             Réponds uniquement par le sujet, rien d'autre.
             """
 
-        data = {
-            "model": "mistral",
-            "prompt": prompt,
-            "stream": False,
-        }
+    def clean_subject(self, response_json):
+        subject_line = response_json.get("response", "").strip()
 
-        try:
-            r = requests.post(self.url, json=data)
-            r.raise_for_status()
-
-            response_json = r.json()
-            subject_line = response_json.get("response", "").strip()
-
-            # Petit filet de sécurité : si jamais le modèle renvoie "Sujet : X"
-            for prefix in ["Sujet :", "Sujet:", "Ligne de sujet :", "Ligne de sujet:"]:
-                if subject_line.lower().startswith(prefix.lower()):
-                    subject_line = subject_line[len(prefix):].strip()
-            
-            subject_line = subject_line.replace('"', '').replace("'", "")   
-
-            return subject_line or "Sujet indisponible"
-
-        except Exception as e:
-            print(f"Erreur lors de l'appel à Ollama ({self.url}): {e}")
-            return "Sujet indisponible"
+        # Petit filet de sécurité : si jamais le modèle renvoie "Sujet : X"
+        for prefix in SUBJECT_PREFIXES:
+            if subject_line.lower().startswith(prefix.lower()):
+                subject_line = subject_line[len(prefix):].strip()
         
-    def prompt_augmentation(self, query):
-        # Generate an answer based on retrieved documents
+        subject_line = subject_line.replace('"', '').replace("'", "")   
 
-        # appele la fonction pour filtrer le sujet de la question
-        query_subject = self.question_subject(query)
-        response, results = self.pipeline.query_search_db(query_subject)
+        return subject_line or SUBJECT_FALLBACK
+
+    def answer_prompt(self, query, response):
+        # Documents dedoublonnes, sans chevauchement, dans la limite du budget de tokens
+        context, stats = self.context_builder.build(response)
+        CONTEXT_TOKENS.labels("raw").inc(stats["raw_tokens"])
+        CONTEXT_TOKENS.labels("packed").inc(stats["context_tokens"])
 
         prompt = f"""
                 Tu es un assistant qui répond uniquement à partir des documents suivants.
@@ -95,9 +307,7 @@ class Generation:
 
                 Ta tâche :
                 - Lis attentivement les documents suivants :
-                {response[0]}
-                {response[1]}
-                {response[2]}
+                {context}
 
                 - Puis, réponds strictement à la question ci-dessous.
                 - Si la réponse n'est pas clairement présente ou déductible des documents, réponds uniquement :
@@ -107,23 +317,243 @@ class Generation:
 
                 Ta réponse finale :
         """
-        
+        PROMPT_TOKENS.observe(estimate_tokens(prompt))
+        return prompt
+
+    def generate(self, prompt, call="answer"):
+        """Blocking call to Ollama through the keep-alive session"""
         data = {
-            "model": "mistral",
+            "model": OLLAMA_MODEL,
             "prompt": prompt,
-            "stream": False
+            "stream": False,
         }
+        with self.pool.lease() as backend:
+            r = self.session.post(backend.url, json=data, timeout=self.timeout)
+            r.raise_for_status()
+        response_json = r.json()
+        record_ollama_usage(call, response_json)
+        return response_json
+
+    async def astream_generate(self, prompt, call="answer", deadline=None):
+        """Yields answer tokens as Ollama produces them (NDJSON stream)"""
+        data = {
+            "model": OLLAMA_MODEL,
+            "prompt": prompt,
+            "stream": True,
+        }
+        async with self.resized_admission().slot(deadline):
+            # L'appel Ollama est borne par ce qui reste du budget de la requete, pas seulement l'attente en file
+            timeout = remaining(deadline, OLLAMA_TIMEOUT)
+            with self.pool.lease() as backend:
+                async with self.async_client.stream(
+                    "POST", backend.url, json=data,
+                    timeout=httpx.Timeout(timeout, connect=min(OLLAMA_CONNECT_TIMEOUT, timeout)),
+                ) as r:
+                    r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if deadline is not None and time.monotonic() > deadline:
+                            raise TimeoutError("Délai de la requête dépassé pendant la génération")
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        token = chunk.get("response", "")
+                        if token:
+                            yield token
+                        if chunk.get("done"):
+                            record_ollama_usage(call, chunk)
+                            break
+
+    async def agenerate(self, prompt, call="answer", deadline=None):
+        """Non-blocking call to Ollama through the pooled async client"""
+        data = {
+            "model": OLLAMA_MODEL,
+            "prompt": prompt,
+            "stream": False,
+        }
+        async with self.resized_admission().slot(deadline):
+            timeout = remaining(deadline, OLLAMA_TIMEOUT)
+            with self.pool.lease() as backend:
+                # Timeout total (httpx ne borne que chaque lecture): une requete admise finit avant son echeance
+                r = await asyncio.wait_for(self.async_client.post(backend.url, json=data), timeout)
+                r.raise_for_status()
+        response_json = r.json()
+        record_ollama_usage(call, response_json)
+        return response_json
+
+    def question_subject(self, query):
+        try:
+            return self.clean_subject(self.generate(self.subject_prompt(query), call="subject"))
+        except Exception as e:
+            print(f"Erreur lors de l'appel à Ollama ({self.pool.hosts}): {e}")
+            return SUBJECT_FALLBACK
+
+    async def aquestion_subject(self, query, deadline=None):
+        try:
+            return self.clean_subject(await self.agenerate(self.subject_prompt(query), call="subject", deadline=deadline))
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"Erreur lors de l'appel à Ollama ({self.pool.hosts}): {e}")
+            return SUBJECT_FALLBACK
         
+    def local_subject(self, query):
+        """Keyphrase subject from the embedding model, None when nothing usable is found"""
         try:
-            r = requests.post(self.url, json=data)
-            r.raise_for_status()
-            
-            response_json = r.json()
+            return self.subject_extractor.extract(query)
+        except Exception as e:
+            print(f"Erreur lors de l'extraction locale du sujet: {e}")
+            return None
+
+    def resolve_subject(self, query, mode=None):
+        # Le mode "local" evite un aller-retour Mistral, l'appel LLM reste le repli
+        with timed("subject"):
+            if (mode or self.subject_mode) == "local":
+                subject = self.local_subject(query)
+                if subject:
+                    return subject
+            return self.question_subject(query)
+
+    async def aresolve_subject(self, query, mode=None, deadline=None):
+        with timed("subject"):
+            if (mode or self.subject_mode) == "local":
+                subject = await asyncio.to_thread(self.local_subject, query)
+                if subject:
+                    return subject
+            return await self.aquestion_subject(query, deadline)
+
+    def remember(self, embedding, answer, results):
+        """Stores a successful answer in the semantic cache"""
+        if not CACHE_ENABLED or embedding is None or answer == GENERATION_UNAVAILABLE:
+            return
+        # Version de l'index qui a servi a la recherche, pas forcement l'index actif
+        version = results.get("index_version", self.pipeline.index_version)
+        self.cache.put(embedding, version, results["ids"][0], answer, results)
+
+    def lookup(self, query):
+        """Returns (query embedding, cached entry or None)"""
+        if not CACHE_ENABLED:
+            return None, None
+        with timed("cache_lookup"):
+            embedding = self.pipeline.encode(query)
+            return embedding, self.cache.get(embedding, self.pipeline.index_version)
+
+    async def alookup(self, query):
+        if not CACHE_ENABLED:
+            return None, None
+        with timed("cache_lookup"):
+            embedding = await self.pipeline.aencode(query)
+            return embedding, self.cache.get(embedding, self.pipeline.index_version)
+
+    def prompt_augmentation(self, query):
+        # Generate an answer based on retrieved documents
+        embedding, cached = self.lookup(query)
+        if cached is not None:
+            return cached["answer"], cached["results"]
+
+        # appele la fonction pour filtrer le sujet de la question
+        query_subject = self.resolve_subject(query)
+        category = self.pipeline.route(query)
+        # Sujet pour la recherche dense, question d'origine pour BM25 (termes exacts, numeros d'articles)
+        response, results = self.pipeline.query_search_db(query_subject, category=category, lexical_query=query)
+
+        try:
+            with timed("generation"):
+                response_json = self.generate(self.answer_prompt(query, response))
             output = response_json.get("response", "").strip()
+            self.remember(embedding, output, results)
             
             return output, results
             
         except Exception as e:
-            print(f"Erreur lors de l'appel à Ollama ({self.url}): {e}")
+            print(f"Erreur lors de l'appel à Ollama ({self.pool.hosts}): {e}")
+
+            return GENERATION_UNAVAILABLE, results
+
+    async def aretrieve(self, query, deadline=None):
+        """Subject extraction + retrieval, returns the answer prompt and the raw Chroma results"""
+        query_subject = await self.aresolve_subject(query, deadline=deadline)
+        # La categorie est deduite de la question complete, pas du sujet resume
+        category = self.pipeline.route(query)
+        # Sujet pour la recherche dense, question d'origine pour BM25 (termes exacts, numeros d'articles)
+        response, results = await self.pipeline.aquery_search_db(query_subject, category=category, lexical_query=query)
+        return self.answer_prompt(query, response), results
+
+    async def abatch_search(self, queries, n_results=N_RESULTS, generate=False, use_subject=False):
+        """Bulk retrieval without the subject LLM call; answers are generated one at a time when asked"""
+        searched = list(queries)
+        if use_subject:
+            # Sujet local uniquement: pas d'appel Mistral par question
+            searched = await asyncio.to_thread(lambda: [self.local_subject(q) or q for q in queries])
+        categories = [self.pipeline.route(q) if q else None for q in queries]
+        hits = await asyncio.to_thread(
+            self.pipeline.batch_query_search_db, searched, n_results, None, categories, list(queries)
+        )
+
+        answers = [None] * len(queries)
+        if generate:
+            # Une seule generation a la fois, chacune admise comme une requete /search, et un seul
+            # budget pour tout le lot: un appel ne garde pas la connexion au-dela de REQUEST_DEADLINE_SECONDS
+            deadline = request_deadline()
+            for i, hit in enumerate(hits):
+                if hit is None:
+                    continue
+                passages, _ = hit
+                try:
+                    with timed("generation"):
+                        response_json = await self.agenerate(self.answer_prompt(queries[i], passages), deadline=deadline)
+                    answers[i] = response_json.get("response", "").strip()
+                except Overloaded as e:
+                    # Budget epuise ou file pleine: les questions restantes ne sont pas generees
+                    print(f"Generation du lot interrompue ({e.reason})")
+                    for j in range(i, len(hits)):
+                        if hits[j] is not None:
+                            answers[j] = GENERATION_UNAVAILABLE
+                    break
+                except Exception as e:
+                    print(f"Erreur lors de l'appel à Ollama ({self.pool.hosts}): {e}")
+                    answers[i] = GENERATION_UNAVAILABLE
+        return hits, answers
+
+    async def aprompt_augmentation(self, query, deadline=None):
+        # Async version: the worker stays free while Ollama and Chroma are busy
+        deadline = deadline or request_deadline()
+        embedding, cached = await self.alookup(query)
+        if cached is not None:
+            return cached["answer"], cached["results"]
+
+        prompt, results = await self.aretrieve(query, deadline)
+
+        try:
+            with timed("generation"):
+                response_json = await self.agenerate(prompt, deadline=deadline)
+            output = response_json.get("response", "").strip()
+            self.remember(embedding, output, results)
+
+            return output, results
+
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"Erreur lors de l'appel à Ollama ({self.pool.hosts}): {e}")
 
-            return "Désolé, le service de génération de réponse est indisponible pour le moment.", results
+            return GENERATION_UNAVAILABLE, results
+
+    async def astream_answer(self, prompt, deadline=None):
+        """Streams the answer tokens, ending with the fallback message if Ollama fails"""
+        sent = False
+        try:
+            with timed("generation"):
+                start = time.perf_counter()
+                async for token in self.astream_generate(prompt, deadline=deadline):
+                    if not sent:
+                        STAGE_LATENCY.labels("first_token").observe(time.perf_counter() - start)
+                    sent = True
+                    yield token
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"Erreur lors de l'appel à Ollama ({self.pool.hosts}): {e}")
+            if sent:
+                # Reponse deja partiellement envoyee: on laisse l'appelant signaler l'erreur
+                raise
+            yield GENERATION_UNAVAILABLE
@@ -0,0 +1,54 @@
+import os
+import re
+
+# Desactive par defaut: les chunks que le classifieur n'a pas reconnus sont ranges dans la premiere
+# categorie, une recherche routee peut donc manquer de meilleurs passages hors de la partition.
+# A activer une fois que le bench montre un rappel equivalent a la recherche globale
+CATEGORY_ROUTING = os.getenv("CATEGORY_ROUTING", "0") == "1"
+# Part minimale du score total pour la categorie dominante, sinon recherche globale
+ROUTING_MIN_CONFIDENCE = float(os.getenv("ROUTING_MIN_CONFIDENCE", "0.6"))
+ROUTING_MIN_SCORE = float(os.getenv("ROUTING_MIN_SCORE", "1"))
+
+class CategoryRouter:
+    """Classifies a question against the base_dechets.json vocabulary used to tag chunks at indexing time"""
+
+    def __init__(self, vocabulary):
+        self.categories = list(vocabulary)
+        self.keyword_weights = {}
+        for category, data in vocabulary.items():
+            for word in data.get("keywords", []):
+                word = word.strip().lower()
+                if word:
+                    self.keyword_weights.setdefault(word, []).append((category, data.get("weight", 1)))
+        if self.keyword_weights:
+            alternatives = "|".join(re.escape(k) for k in sorted(self.keyword_weights, key=len, reverse=True))
+            self.pattern = re.compile(r"\b(?:" + alternatives + r")\b")
+        else:
+            self.pattern = None
+
+    def scores(self, question):
+        scores = dict.fromkeys(self.categories, 0.0)
+        if self.pattern is None:
+            return scores
+        for match in self.pattern.finditer(question.lower()):
+            for category, weight in self.keyword_weights[match.group(0)]:
+                scores[category] += weight
+        return scores
+
+    def classify(self, question):
+        """Returns (category, confidence); category is None when no keyword matches"""
+        scores = self.scores(question)
+        total = sum(scores.values())
+        if total <= 0:
+            return None, 0.0
+        best = max(scores, key=scores.get)
+        if scores[best] < ROUTING_MIN_SCORE:
+            return None, 0.0
+        return best, scores[best] / total
+
+    def route(self, question):
+        """Category partition to search, or None for a global search"""
+        category, confidence = self.classify(question)
+        if category is None or confidence < ROUTING_MIN_CONFIDENCE:
+            return None
+        return category
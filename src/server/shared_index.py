@@ -0,0 +1,100 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import chromadb
+from db_connexion import download_directory, copy_snapshot, load_manifest, exclusive_lock, release_chroma_client
+from corpus import CorpusTable
+from lexical import BM25Index
+
+# Mode multi-workers: un seul snapshot telecharge et exporte en fichiers mmap, partage en lecture seule
+SHARED_INDEX_DIR = os.getenv("SHARED_INDEX_DIR", "").strip()
+# Snapshots conserves sur disque (l'actif + le precedent, encore mappe par les workers en retard)
+SHARED_INDEX_KEEP = int(os.getenv("SHARED_INDEX_KEEP", "2"))
+# Intervalle (secondes) auquel chaque worker verifie si un autre a publie un snapshot plus recent
+SHARED_INDEX_POLL = float(os.getenv("SHARED_INDEX_POLL", "30"))
+REMOTE_DB_PATH = "chromadb"
+# Cle du snapshot actif, ecrite sous le verrou par le worker qui le prepare
+CURRENT_FILE = "current"
+
+def shared_lock():
+    return exclusive_lock(os.path.join(SHARED_INDEX_DIR, ".lock"))
+
+def current_snapshot_key():
+    """Key of the snapshot most recently prepared by any worker, None if there is none yet"""
+    try:
+        with open(os.path.join(SHARED_INDEX_DIR, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def set_current_snapshot(key):
+    path = os.path.join(SHARED_INDEX_DIR, CURRENT_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(key)
+    os.replace(path + ".tmp", path)
+
+def snapshot_key(cache_dir):
+    """Stable key of the downloaded Chroma files (paths, sizes and etags from the download manifest)"""
+    manifest = load_manifest(cache_dir)
+    digest = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def export_snapshot(cache_dir, target, key):
+    """Reads the collection once from a private copy and writes the memory-mappable files"""
+    work_dir = tempfile.mkdtemp(prefix="chroma_db_")
+    staging = target + ".tmp"
+    client = None
+    try:
+        copy_snapshot(cache_dir, work_dir)
+        client = chromadb.PersistentClient(path=work_dir)
+        collection = client.get_or_create_collection(name="law_text")
+        version = (collection.metadata or {}).get("index_version") or key
+
+        corpus = CorpusTable.from_collection(collection)
+        shutil.rmtree(staging, ignore_errors=True)
+        corpus.save(staging)
+        BM25Index(corpus.documents).save(staging)
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "key": key, "documents": len(corpus)}, f)
+        os.replace(staging, target)
+        print(f"[SERVER] Snapshot partagé exporté: {target} ({len(corpus)} chunks)")
+    finally:
+        if client is not None:
+            release_chroma_client(client)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shutil.rmtree(staging, ignore_errors=True)
+
+def prune_snapshots(snapshots_dir, keep, current):
+    # Appele sous le verrou: aucun worker n'est en train de charger un snapshot.
+    # Sous Linux, un fichier supprime reste lisible par les processus qui l'ont deja mappe
+    entries = [
+        os.path.join(snapshots_dir, name)
+        for name in os.listdir(snapshots_dir)
+        if not name.endswith(".tmp") and os.path.join(snapshots_dir, name) != current
+    ]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[max(0, keep - 1):]:
+        shutil.rmtree(path, ignore_errors=True)
+
+def load_shared_snapshot(file_system):
+    """Syncs, exports if this worker is first, and maps the current snapshot
+
+    Everything runs under the shared lock, so a prune triggered by another worker cannot
+    delete the snapshot while it is being opened. Returns (meta, corpus, lexical, path).
+    """
+    snapshots_dir = os.path.join(SHARED_INDEX_DIR, "snapshots")
+    os.makedirs(snapshots_dir, exist_ok=True)
+    with shared_lock():
+        cache_dir = os.path.join(SHARED_INDEX_DIR, REMOTE_DB_PATH)
+        download_directory(file_system, REMOTE_DB_PATH, cache_dir)
+        key = snapshot_key(cache_dir)
+        target = os.path.join(snapshots_dir, key)
+        if not os.path.exists(os.path.join(target, "meta.json")):
+            export_snapshot(cache_dir, target, key)
+        set_current_snapshot(key)
+        prune_snapshots(snapshots_dir, max(1, SHARED_INDEX_KEEP), target)
+        with open(os.path.join(target, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return meta, CorpusTable.load(target), BM25Index.load(target), target
@@ -0,0 +1,126 @@
+import os
+import re
+import json
+import unicodedata
+import numpy as np
+from db_connexion import read_text_from_adls, JSON_FILE
+
+# "llm": appel Mistral (comportement historique, par defaut), "local": extraction de mots-cles par embeddings
+# (a activer une fois valide avec bench/compare_subject.py)
+SUBJECT_MODE = os.getenv("SUBJECT_MODE", "llm").strip().lower()
+SUBJECT_MAX_WORDS = int(os.getenv("SUBJECT_MAX_WORDS", "8"))
+SUBJECT_MAX_NGRAM = 3
+# Bonus de score pour les expressions presentes dans le vocabulaire de base_dechets.json
+VOCABULARY_BOOST = float(os.getenv("SUBJECT_VOCABULARY_BOOST", "0.15"))
+
+STOPWORDS = {
+    "a", "à", "afin", "ai", "aie", "ainsi", "alors", "au", "aucun", "aucune", "aussi", "autre", "aux",
+    "avec", "avoir", "bien", "c", "ça", "ce", "ceci", "cela", "celle", "celles", "celui", "ces", "cet",
+    "cette", "ceux", "chaque", "chez", "comme", "comment", "d", "dans", "de", "des", "dois", "doit",
+    "doivent", "donc", "donne", "donner", "dont", "du", "elle", "elles", "en", "encore", "entre", "est",
+    "et", "être", "etc", "eux", "faire", "faut", "fait", "il", "ils", "j", "je", "l", "la", "le", "les",
+    "leur", "leurs", "lui", "m", "ma", "mais", "me", "mes", "moi", "mon", "même", "n", "ne", "ni",
+    "nos", "notre", "nous", "on", "ont", "ou", "où", "par", "pas", "peut", "peuvent", "peux", "plus",
+    "pour", "pourquoi", "puis", "puis-je", "qu", "quand", "que", "quel", "quelle", "quelles", "quels",
+    "qui", "quoi", "s", "sa", "sans", "se", "ses", "si", "son", "sont", "sous", "suis", "sur", "t",
+    "ta", "te", "tes", "toi", "ton", "tous", "tout", "toute", "toutes", "très", "tu", "un", "une",
+    "vos", "votre", "vous", "y", "est-ce", "existe", "il-y-a", "quelqu", "svp", "merci",
+}
+
+TOKEN_PATTERN = re.compile(r"\w+(?:-\w+)*", re.UNICODE)
+
+def strip_accents(text):
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+def short_token(token):
+    # Les numeros (articles, annexes) restent: ce sont les termes les plus selectifs d'une question juridique
+    return len(token) < 2 and not token.isdigit()
+
+def load_vocabulary(file_system_client):
+    """Loads the base_dechets.json categories ({categorie: {"weight", "keywords"}}) from ADLS"""
+    json_content = read_text_from_adls(file_system_client, JSON_FILE)
+    if json_content is None:
+        print(f"[SERVER] Avertissement: {JSON_FILE} indisponible, vocabulaire vide.")
+        return {}
+    return json.loads(json_content)
+
+class LocalSubjectExtractor:
+    """Builds the retrieval subject from keyphrases of the question, without an LLM round-trip"""
+
+    def __init__(self, model, vocabulary):
+        self.model = model
+        keywords = {
+            word.strip().lower()
+            for data in vocabulary.values()
+            for word in data.get("keywords", [])
+            if word.strip()
+        }
+        self.keywords = keywords
+        # Une seule regex pour tout le vocabulaire, les expressions longues d'abord
+        if keywords:
+            alternatives = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+            self.keyword_pattern = re.compile(r"\b(?:" + alternatives + r")\b")
+        else:
+            self.keyword_pattern = None
+
+    def candidates(self, question):
+        """Returns {phrase: position} for vocabulary matches and stopword-free n-grams"""
+        text = question.lower()
+        found = {}
+
+        if self.keyword_pattern is not None:
+            for match in self.keyword_pattern.finditer(text):
+                found.setdefault(match.group(0), match.start())
+
+        tokens = [(m.group(0), m.start()) for m in TOKEN_PATTERN.finditer(text)]
+        for n in range(1, SUBJECT_MAX_NGRAM + 1):
+            for i in range(len(tokens) - n + 1):
+                gram = tokens[i:i + n]
+                first, last = gram[0][0], gram[-1][0]
+                if first in STOPWORDS or last in STOPWORDS or short_token(first) or short_token(last):
+                    continue
+                phrase = text[gram[0][1]:gram[-1][1] + len(last)]
+                found.setdefault(phrase, gram[0][1])
+        return found
+
+    def extract(self, question):
+        """Returns a short subject (at most SUBJECT_MAX_WORDS words) or None"""
+        text = question.lower()
+        candidates = self.candidates(question)
+        if not candidates:
+            return None
+
+        phrases = list(candidates)
+        embeddings = self.model.encode([question] + phrases, convert_to_numpy=True, normalize_embeddings=True)
+        scores = embeddings[1:] @ embeddings[0]
+        scores = scores + np.array([VOCABULARY_BOOST if p in self.keywords else 0.0 for p in phrases])
+
+        chosen = []
+        covered = set()
+        words = 0
+        for i in np.argsort(-scores):
+            phrase = phrases[i]
+            # Memes tokens que les candidats (l'apostrophe separe les mots): "l'article" couvre "article"
+            tokens = {strip_accents(t) for t in TOKEN_PATTERN.findall(phrase)}
+            # Ignore les expressions deja couvertes par une expression retenue
+            if tokens <= covered:
+                continue
+            size = len(tokens - covered)
+            if words + size > SUBJECT_MAX_WORDS:
+                continue
+            start = candidates[phrase]
+            chosen.append((start, start + len(phrase)))
+            covered |= tokens
+            words += size
+            if words >= SUBJECT_MAX_WORDS:
+                break
+
+        # Remet les expressions dans l'ordre de la question et fusionne celles qui se chevauchent
+        # ("amende selon" + "selon l'article" -> "amende selon l'article"): aucun mot n'est repete
+        spans = []
+        for start, end in sorted(chosen):
+            if spans and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            else:
+                spans.append([start, end])
+        return " ".join(text[start:end] for start, end in spans) or None